@@ -0,0 +1,364 @@
+# !/usr/bin/python3
+"""
+AsyncComms - the CommsController contract run on a single asyncio event loop.
+
+Every CommsServer and CommsListener is a thread of its own, most of them
+just sitting waiting on a connection or a message, and the thread count
+grows with every connection.  Here the servers and listeners are tasks on
+one shared event loop thread, and the controller's dispatcher drains the
+mailboxes on that loop too, so adding connections and servers adds tasks
+rather than threads.
+
+Overview (as for CommsController):
+AsyncController - a CommsController delivering listener events on the loop
+AsyncServer     - waits for connections with "await receiver.accept()"
+AsyncListener   - waits for messages with "await receiver.getMessage()"
+Adapters bridge existing receivers into the loop:
+BlockingReceiver - wraps a blocking CommsReceiver or MessageReceiver,
+                   running its waits on a thread of its own
+CallbackReceiver - for callback style sources (like Blue Dot), whose
+                   callbacks push() connections or messages onto the loop
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+
+from CommsController import CommsController, Dispatcher, CommsReceiver, MessageReceiver
+
+
+loops = [None]  # the shared event loop, see eventLoop()
+loopLock = Lock()
+
+
+def eventLoop():
+    '''
+    The shared event loop, started on its own thread the first time.
+    '''
+    with loopLock:
+        if not loops[0]:
+            loop = asyncio.new_event_loop()
+            thread = Thread(target=loop.run_forever, daemon=True)
+            thread.start()
+            loops[0] = loop
+    return loops[0]
+
+
+class AsyncDispatcher(Dispatcher):
+    '''
+    A Dispatcher that drains each mailbox on the event loop
+    rather than on a thread of its own.
+    '''
+
+    def __init__(self, controller, loop=None):
+        Dispatcher.__init__(self, controller)
+        self.loop = loop or eventLoop()
+        return
+
+    def start(self):
+        return  # nothing to start, the loop is already running
+
+    def stop(self):
+        self.ok = False
+        return
+
+    def wake(self, connectionId):
+        self.loop.call_soon_threadsafe(self.drain, connectionId)
+        return
+
+    def drain(self, connectionId):
+        events = self.take(connectionId)
+        if events:  # not discarded
+            self.deliver(connectionId, events)
+        return
+
+
+class AsyncController(CommsController):
+    '''
+    A CommsController whose listener events are delivered on the event loop.
+
+    Use as the first base class to make other controllers asynchronous,
+    e.g. class AsyncControlledBoat(AsyncController, ControlledBoat).
+    '''
+
+    def makeDispatcher(self):
+        return AsyncDispatcher(self)
+
+
+class BlockingReceiver():
+    '''
+    BlockingReceiver(receiver, loop)
+    Adapts a blocking "receiver" (a CommsReceiver or MessageReceiver)
+    so accept() and getMessage() can be awaited on the "loop".
+
+    Each wait blocks a thread until something arrives, so each
+    BlockingReceiver has a single thread executor of its own rather than
+    sharing the loop's default one (only min(32, cpus + 4) threads,
+    which would leave further receivers waiting for a free thread).
+    That is still one thread per blocking receiver, so use a
+    CallbackReceiver where the source allows it.
+    '''
+
+    def __init__(self, receiver, loop=None):
+        self.receiver = receiver
+        self.loop = loop or eventLoop()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        return
+
+    async def accept(self):
+        return await self.loop.run_in_executor(self.executor, self.receiver.accept)
+
+    async def getMessage(self):
+        return await self.loop.run_in_executor(self.executor, self.receiver.getMessage)
+
+    def close(self):
+        self.receiver.close()  # wakes any wait
+        self.executor.shutdown(wait=False)
+        return
+
+
+class CallbackReceiver():
+    '''
+    CallbackReceiver(loop, onClose)
+    A receiver for callback style sources: a callback, on any thread,
+    calls receiver.push(item) and whatever is awaiting accept() or
+    getMessage() on the "loop" gets the item.
+    "onClose" (if given) is called on close() to stop the source.
+    '''
+
+    def __init__(self, loop=None, onClose=None):
+        self.loop = loop or eventLoop()
+        self.onClose = onClose
+        self.queue = asyncio.Queue()
+        return
+
+    def push(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        return
+
+    async def accept(self):
+        return await self.queue.get()
+
+    async def getMessage(self):
+        return await self.queue.get()
+
+    def close(self):
+        if self.onClose:
+            self.onClose()
+            self.onClose = None
+        return
+
+
+class AsyncServer():
+    '''
+    This is a server generating listeners from connections, as a task on the loop.
+
+    As for CommsServer, children should override:
+       makeReceiver(self)- returns a receiver using self.setup
+          whose accept() can be awaited for the connection data
+       makeListener(connection)- returns a listener using connection and self.controller
+    '''
+
+    def __init__(self, setup=None, loop=None):
+        self.setup = setup
+        self.loop = loop or eventLoop()
+        self.receiver = self.makeReceiver()  # for receiving connections
+        self.serverId = None
+        self.controller = None
+        self.task = None
+        self.ok = False
+        return
+
+    def shutdown(self):
+        self.ok = False
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.receiver:
+            self.receiver.close()
+            self.receiver = None
+        return
+
+    def startup(self, serverId, controller):
+        self.serverId, self.controller = serverId, controller
+        if self.receiver:
+            self.ok = True
+            self.task = asyncio.run_coroutine_threadsafe(self.serve(), self.loop)
+        else:
+            self.ok = False
+        return self.ok
+
+    async def serve(self):
+        loop = 0
+        while self.ok:
+            try:
+                loop += 1
+                # wait for connection on the receiver
+                connection = await self.receiver.accept()
+                # convert connection into a listener
+                listener = self.makeListener(connection)
+                # let the controller know and start it listening
+                self.controller.connected(listener)
+                # some receivers need to be recrated after a connection
+                if not self.receiver:
+                    self.receiver = self.makeReceiver()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"AsyncServer.serve({loop}) conection exception:", e)
+                self.ok = False
+        self.controller.stopping(self.serverId)
+        return
+
+    '''
+    These methods must be overwritten
+    '''
+
+    def makeReceiver(self):
+        return BlockingReceiver(CommsReceiver(self.setup), self.loop)
+
+    def makeListener(self, connection):
+        listener = None
+        if connection:
+            listener = AsyncListener(connection, controller=self.controller, loop=self.loop)
+        return listener
+
+
+class AsyncListener():
+    '''
+    Listener is a task on the loop listening for messages.
+
+    As for CommsListener, children should override
+    makeReceiver(connection) and execute(message).
+    Listeners for callback style sources can override startup()
+    to connect the callbacks to the controller instead of using a task.
+    '''
+
+    def __init__(self, connection, controller=None, loop=None):
+        self.loop = loop or eventLoop()
+        self.receiver = None
+        if connection:
+            self.receiver = self.makeReceiver(connection)
+        self.controller = controller
+        self.connectionId = None
+        self.task = None
+        self.ok = False
+        return
+
+    def shutdown(self):
+        self.ok = False
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.receiver:
+            self.receiver.close()
+            self.receiver = None
+        return
+
+    def startup(self, connectionId, controller):
+        self.connectionId = connectionId
+        self.controller = controller
+        if self.receiver:
+            self.ok = True
+            if not self.task:  # not yet started ...
+                self.task = asyncio.run_coroutine_threadsafe(self.listen(), self.loop)
+        else:
+            self.ok = False
+        return self.ok
+
+    async def listen(self):
+        while self.ok:
+            try:
+                message = await self.receiver.getMessage()
+                if message:
+                    self.execute(message)
+                else:
+                    self.ok = False
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("AsyncListener exception:", e)
+                self.ok = False
+        self.task = None
+        if self.controller:
+            self.controller.disconnected(self.connectionId)
+        return
+
+    #
+    # these should be overridden
+    #
+
+    def makeReceiver(self, connection):
+        return BlockingReceiver(MessageReceiver(setup=connection), self.loop)
+
+    def execute(self, message):
+        # should be overridden
+        x = 1
+        y = -1
+        if message[0].lower() == "p":
+            self.controller.press(self.connectionId, x, y)
+        elif message[0].lower() == "m":
+            self.controller.move(self.connectionId, x, y)
+        elif message[0].lower() == "l":
+            self.controller.lift(self.connectionId, x, y)
+        elif message[0].lower() == "d":
+            self.controller.double(self.connectionId, x, y)
+        elif message[0].lower() == "c":
+            self.receiver.close()
+        elif message[0].lower() == "e":
+            raise Exception("Disconnected by exception")
+        return
+
+
+if __name__ == '__main__':
+    # lots of connections, each pushing messages from its own callbacks
+    from threading import active_count
+    from time import sleep
+
+    from CommsController import CountingBoat
+
+    class PushListener(AsyncListener):
+
+        def makeReceiver(self, connection):
+            return connection  # a CallbackReceiver
+
+        def execute(self, message):
+            kind, x, y = message
+            getattr(self.controller, kind)(self.connectionId, x, y)
+            return
+
+    class PushServer(AsyncServer):
+
+        def makeReceiver(self):
+            return CallbackReceiver(self.loop)
+
+        def makeListener(self, connection):
+            return PushListener(connection, controller=self.controller, loop=self.loop)
+
+    print("threads before:", active_count())
+    boat = CountingBoat()
+    controller = AsyncController(boat=boat)
+    servers = [PushServer() for i in range(4)]
+    for server in servers:
+        controller.addServer(server)
+    connections = []
+    for i in range(40):
+        connection = CallbackReceiver()
+        servers[i % len(servers)].receiver.push(connection)
+        connections.append(connection)
+    sleep(0.2)
+    print("threads with", len(servers), "servers and",
+          len(controller.listeners), "listeners:", active_count())
+    navigator = controller.listeners[0].receiver  # connection 0 navigates
+    navigator.push(("press", 0, 0.1))
+    for i in range(1000):
+        navigator.push(("move", 0, i / 1000))
+    navigator.push(("lift", 0, 1))
+    sleep(0.5)
+    print("navigator: posted", controller.dispatcher.posted,
+          "navigated", boat.navigated, "ending at", (boat.x, boat.y))
+    for connection in connections:
+        connection.push(None)  # hang up
+    sleep(0.2)
+    print("listeners left:", len([l for l in controller.listeners if l]))
+    controller.shutdown()
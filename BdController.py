@@ -10,6 +10,7 @@ from time import sleep
 
 from bluedot import BlueDot
 
+from AsyncComms import AsyncServer, AsyncListener, CallbackReceiver
 from CommsController import CommsServer, CommsListener, CommsReceiver, MessageReceiver
 
 
@@ -177,6 +178,99 @@ class BdMessageReceiver(MessageReceiver):
         return
 
 
+class AsyncBdServer(AsyncServer):
+    '''
+    A BdServer as a task on the shared event loop.
+
+    Blue Dot tells us about connections and messages with callbacks,
+    so nothing needs a thread waiting on it.
+    '''
+
+    def makeReceiver(self):
+        bd = None
+        port = 1
+        while not bd:
+            try:
+                bd = BlueDot(port=port)
+            except:
+                port += 1
+                bd = None
+        receiver = CallbackReceiver(self.loop, onClose=bd.stop)
+        bd.when_client_connects = lambda: receiver.push(bd)
+        if bd.is_connected:  # before we were listening
+            receiver.push(bd)
+        return receiver
+
+    def makeListener(self, connection):
+        # connection is the BlueDot object, so need a new one after this ...
+        listener = None
+        if connection:
+            try:
+                connection.when_client_connects = None
+                listener = AsyncBdListener(
+                    connection, controller=self.controller, loop=self.loop)
+            except Exception as e:
+                print(e)
+                print(sys.exc_info())
+            self.receiver = None
+        return listener
+
+
+class AsyncBdListener(AsyncListener):
+    '''
+    A BdListener whose Blue Dot callbacks go straight to the controller,
+    so it needs no task or thread of its own.
+    '''
+
+    def makeReceiver(self, connection):
+        # turn a connection (a BlueDot) into the receiver
+        return BdMessageReceiver(setup=connection)
+
+    def startup(self, connectionId, controller):
+        self.connectionId = connectionId
+        self.controller = controller
+        bd = self.receiver.bd
+        if connectionId == 0:
+            # navigate - green square
+            bd.square = True
+            bd.color = "green"
+        else:
+            # targetting gun number ...
+            bd.square = False
+            bd.color = ("green", "red", "orange", "yellow")[connectionId]
+        bd.when_client_disconnects = self.disconnect
+        bd.when_double_pressed = self.double
+        bd.when_pressed = self.press
+        bd.when_released = self.lift
+        bd.when_moved = self.move
+        self.ok = True
+        return self.ok
+
+    def disconnect(self):
+        # on the Blue Dot thread, so let the loop tell the controller
+        if self.ok:
+            self.ok = False
+            self.loop.call_soon_threadsafe(
+                self.controller.disconnected, self.connectionId)
+        return
+
+    def double(self, pos):
+        self.controller.double(self.connectionId, pos.x, pos.y)
+        return
+
+    def press(self, pos):
+        self.controller.press(self.connectionId, pos.x, pos.y)
+        return
+
+    def lift(self, pos):
+        self.controller.lift(self.connectionId, pos.x, pos.y)
+        return
+
+    def move(self, pos):
+        self.controller.move(self.connectionId, pos.x, pos.y)
+        return
+
+
 # no class BdConnection()
 
 
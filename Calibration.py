@@ -0,0 +1,145 @@
+# !/usr/bin/python3
+"""
+Calibration - non-linear calibration curves for the boat's motors and rudder.
+
+Cheap motors have a large deadband and do not respond linearly,
+so the linear ratios in GPIOZeroBoat are not enough to balance them.
+Each motor and the rudder can be given a curve of (input, output) points,
+with straight lines between them, in a JSON file like:
+
+    {
+        "left": [[-1, -1], [-0.05, -0.3], [0, 0], [0.05, 0.3], [1, 1]],
+        "rudder": [[-1, -0.8], [1, 0.8]]
+    }
+
+Any of "left", "right", "center" and "rudder" can be left out and is then
+passed straight through.  Each curve is compiled into a dense lookup array
+so applying it is just an index, and reload() rereads the file so they can
+be tweaked while the boat is running.
+"""
+
+import json
+from array import array
+
+
+NAMES = ("left", "right", "center", "rudder")
+SIZE = 1001  # points across -1 to 1, so steps of 0.002
+
+
+def compileCurve(points, size=SIZE):
+    '''
+    Make a lookup array of size entries for inputs evenly spaced from -1 to 1
+    from the piecewise-linear curve through points ((input, output), ...).
+
+    Inputs beyond the first or last point get the output of that point.
+    Outputs must be from -1 to 1, as for the motors and servo.
+    '''
+    points = [(float(point[0]), float(point[1])) for point in points]
+    if len(points) < 2:
+        raise ValueError('A curve needs at least two points')
+    for i in range(1, len(points)):
+        if points[i][0] <= points[i - 1][0]:
+            raise ValueError('Curve points must have increasing inputs')
+    for point in points:
+        if not -1.0 <= point[1] <= 1.0:
+            raise ValueError('Curve outputs must be from -1 to 1, not %s' % point[1])
+    half = (size - 1) / 2
+    table = array('d', bytes(8 * size))
+    segment = 0
+    last = len(points) - 1
+    for i in range(size):
+        x = (i - half) / half
+        while segment < last - 1 and x > points[segment + 1][0]:
+            segment += 1
+        x0, y0 = points[segment]
+        x1, y1 = points[segment + 1]
+        if x <= x0:
+            table[i] = y0
+        elif x >= x1:
+            table[i] = y1
+        else:
+            table[i] = y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return table
+
+
+class Calibration():
+    '''
+    Calibration(path, size)
+    Where "path" is a JSON file of curves as above (or None for none yet)
+    and "size" is the number of lookup entries per curve
+    (odd so that 0 is an entry, default 1001).
+
+    calibration.apply(left, right, center, rudder) gives them calibrated,
+    calibration.reload() rereads the file and swaps in the new curves.
+    '''
+
+    def __init__(self, path=None, size=SIZE):
+        self.path = path
+        self.size = size
+        self.half = (size - 1) / 2
+        self.tables = (None, None, None, None)
+        if path:
+            self.reload()
+        return
+
+    def load(self, curves):
+        '''
+        Compile and use curves, a dictionary of name to points as in the file.
+
+        All are compiled before any are used, so a bad curve changes nothing.
+        '''
+        for name in curves:
+            if name not in NAMES:
+                raise ValueError('Unknown calibration curve %s' % name)
+        tables = []
+        for name in NAMES:
+            points = curves.get(name)
+            if points:
+                tables.append(compileCurve(points, self.size))
+            else:
+                tables.append(None)
+        self.tables = tuple(tables)  # in one go for anyone applying them
+        return
+
+    def reload(self):
+        '''
+        Reread the curves from self.path.
+        '''
+        with open(self.path) as file:
+            self.load(json.load(file))
+        return
+
+    def apply(self, left, right, center, rudder):
+        tables = self.tables
+        half = self.half
+        last = self.size - 1
+        values = [left, right, center, rudder]
+        for n in range(4):
+            table = tables[n]
+            if table is not None:
+                i = int((values[n] + 1.0) * half + 0.5)
+                if i < 0:
+                    i = 0
+                elif i > last:
+                    i = last
+                values[n] = table[i]
+        return values
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+
+    calibration = Calibration()
+    calibration.load({
+        "left": [[-1, -1], [-0.05, -0.3], [0, 0], [0.05, 0.3], [1, 1]],
+        "rudder": [[-1, -0.8], [1, 0.8]],
+    })
+    for value in (-1, -0.5, -0.05, -0.02, 0, 0.02, 0.05, 0.5, 1):
+        print(value, "->", calibration.apply(value, value, value, value))
+
+    count = 100000
+    start = perf_counter()
+    for i in range(count):
+        calibration.apply(0.3, -0.3, 0.7, 0.1)
+    taken = perf_counter() - start
+    print("apply: %.2f us each" % (1e6 * taken / count))
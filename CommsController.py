@@ -7,12 +7,27 @@ Controller  - does what it says on the tin.  Accepts attaching of Servers
 Servers     - Once accepted, wait for connections.  And creates them into listeners and passes them to the controller.
 Listener    - Listen for messages from clients and translates them into actions on the controller.
 Message     - Specific to client, but interpreted as action (press, move, lift, double) and location
+Dispatcher  - Delivers the actions to the controller from one thread, only the latest of a run of moves
+CountingBoat - A stand in boat for trying out controllers and transports
 """
 
 import math
-from threading import Thread, enumerate
+from collections import deque
+from threading import Thread, Condition, enumerate, current_thread
 from time import sleep
 
+try:
+    import numpy
+except ImportError:  # only needed for xy2raArrays()
+    numpy = None
+
+from Watchdog import Watchdog
+
+
+RADII = 100  # steps of radius looked at to find the targeting table's bands
+ANGLES = 720  # steps of angle in the targeting table
+TWO_PI = 2 * math.pi
+
 
 def dp2(number):
     return format(number, "03.2f")
@@ -24,30 +39,26 @@ def xy2ra(x, y):
 
     -1.0 <= x, y <= 1.0 are cartesian coordinates.
     Convert to r (radius) and a (angle), where 0.0 <= r, a <= 1.0
-    So a is a fraction of the whole circle, and r is distance from the center, capped at 1.0
+    So a is a fraction of the whole circle, clockwise from straight ahead (y),
+    and r is distance from the center, capped at 1.0
     '''
-    a = 0
-    r = math.sqrt(x * x + y * y)
+    r = math.hypot(x, y)
     if r > 1.0:
         r = 1.0
     if r > 0.1:  # angle only relevant if a distance from the center!
-        ax, ay = abs(a), abs(y)
-        sx = sy = 1  # +ve
-        if x < 0:
-            sx = -1
-        if y < 0:
-            sy = -1
-        ss = sx * sy
-        # to avoid divide by zero and rediculously big numbers ...
-        if ax > ay:
-            f = y / x
-            aTanXY = math.atan(f) / math.pi
-            aTanXY = ss * (1 - aTanXY)
-        else:
-            f = x / y
-            aTanXY = math.atan(f) / math.pi
-        h = ((1 - sx) + (1 - ss)) / 2  # I call it the half number
-        a = (h + aTanXY) / 2
+        return r, (math.atan2(x, y) / TWO_PI) % 1.0
+    return r, 0
+
+
+def xy2raArrays(x, y):
+    '''
+    NumPy version of xy2ra() for arrays of x and y (e.g. a recorded touch stream),
+    giving arrays of r and a.
+    '''
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    r = numpy.minimum(numpy.hypot(x, y), 1.0)
+    a = numpy.where(r > 0.1, numpy.mod(numpy.arctan2(x, y) / TWO_PI, 1.0), 0.0)
     return r, a
 
 
@@ -88,9 +99,44 @@ class CommsController():
         # uncomment the following line to stop navigation connection ...
         # self.listeners.append(CommsListener(None)) # temp fix to get to targets
         self.targets = 0
+        self.watchdog = None  # see setWatchdog()
+        self.aims = None  # see compileAims()
+        self.aimsFor = None
+        # events from listeners are handled by one dispatcher thread
+        self.handlers = {"press": self.pressed, "move": self.moved,
+                         "lift": self.lifted, "double": self.doubled}
+        self.dispatcher = self.makeDispatcher()
+        self.dispatcher.start()
         self.addBoat(boat)
         return
 
+    def setWatchdog(self, milliseconds=None):
+        '''
+        Stop the boat if the navigation stick is held away from the center
+        and no input arrives for milliseconds, None (the default) for never.
+
+        Only for sources that keep sending while the stick is held,
+        like a socket client repeating its move as a keep-alive,
+        not Blue Dot, which only sends as the finger moves.
+        The watchdog keeps count of how often it has had to stop the boat
+        and how late it noticed (see Watchdog).
+        '''
+        if milliseconds:
+            self.watchTimeout = milliseconds / 1000
+            if not self.watchdog:
+                self.watchdog = Watchdog()
+                self.watchdog.start()
+        elif self.watchdog:
+            self.watchdog.stop()
+            self.watchdog = None
+        return
+
+    def starved(self):
+        # the watchdog has not heard from the navigator in time
+        print("No navigation input, stopping the boat")
+        self.boat.stop()
+        return
+
     def addBoat(self, boat):
         self.boat = boat
         # need to know that number and layout of guns
@@ -111,11 +157,13 @@ class CommsController():
         # if 3 guns - back and middle and front, unless triangle:
         #           - back and port and starboard
         self.guns = guns
+        self.compileAims()
         self.boat.centerGuns()
         return
 
     def shutdown(self):
         # try and close neatly ...
+        self.setWatchdog(None)
         for server in self.servers:
             server.shutdown()
         self.servers = []
@@ -123,6 +171,11 @@ class CommsController():
             if self.listeners[connectionId]:
                 self.disconnect(connectionId)
         self.listeners = []
+        # deliver anything still waiting (like the navigator's lift) and stop
+        dispatcher = self.dispatcher
+        dispatcher.stop()
+        if dispatcher.is_alive() and dispatcher is not current_thread():
+            dispatcher.join(1)
         print("Threads:", enumerate())
         return
 
@@ -176,6 +229,10 @@ class CommsController():
         listener = self.listeners[connectionId]
         if listener:
             self.listeners[connectionId] = None  # remove it
+            # still deliver its presses and lifts, and stop if it was navigating
+            self.dispatcher.discard(connectionId)
+            if connectionId == 0:
+                self.dispatcher.post(connectionId, "lift", 0, 0)
             listener.shutdown()
             if connectionId > 0:  # targetting
                 self.targets -= 1
@@ -183,18 +240,45 @@ class CommsController():
 
     def press(self, connectionId, x, y):
         # called by a listener that recieves a press at a position
-        ### print("press", connectionId, (dp2(x), dp2(y)))
-        self.navigate(connectionId, x, y)
+        self.dispatcher.post(connectionId, "press", x, y)
         return
 
     def move(self, connectionId, x, y):
         # called by a listener that recieves a move to a position
-        ### print("move", connectionId, (dp2(x), dp2(y)))
-        self.navigate(connectionId, x, y)
+        # any move still waiting is just replaced by this one
+        self.dispatcher.post(connectionId, "move", x, y)
         return
 
     def lift(self, connectionId, x, y):
         # called by a listener that recieves a lift from a position
+        self.dispatcher.post(connectionId, "lift", x, y)
+        return
+
+    def double(self, connectionId, x, y):
+        # called by a listener that recieves a double-click at a position
+        self.dispatcher.post(connectionId, "double", x, y)
+        return
+
+    def makeDispatcher(self):
+        # the dispatcher to deliver listener events (see Dispatcher)
+        return Dispatcher(self)
+
+    def deliver(self, connectionId, kind, x, y):
+        # called by the dispatcher with the next event from a mailbox
+        self.handlers[kind](connectionId, x, y)
+        return
+
+    def pressed(self, connectionId, x, y):
+        ### print("press", connectionId, (dp2(x), dp2(y)))
+        self.navigate(connectionId, x, y)
+        return
+
+    def moved(self, connectionId, x, y):
+        ### print("move", connectionId, (dp2(x), dp2(y)))
+        self.navigate(connectionId, x, y)
+        return
+
+    def lifted(self, connectionId, x, y):
         ### print("lift", connectionId, (dp2(x), dp2(y)))
         if connectionId == 0:  # navigate - stop when lift
             self.navigate(connectionId, 0, 0)  # all stop on lift!
@@ -212,86 +296,26 @@ class CommsController():
         else:
             if self.boat:
                 self.boat.navigate(x, y)
+                watchdog = self.watchdog
+                if watchdog:
+                    if x or y:  # only while it should be moving
+                        watchdog.feed(connectionId, self.watchTimeout, self.starved)
+                    else:
+                        watchdog.cancel(connectionId)
         return
 
     def target(self, connectionId, x, y):
         radius, angle = xy2ra(x, y)
-        # print("CommsController.target: connectionId =", connectionId, "angle =", dp2(angle), "radius=", dp2(radius))
-        # print("self.targets =", self.targets, "self.triangle =", self.triangle)
         if self.targets == 1:
-            # one to do all guns
-            if self.square:  # split four ways
-                print("square: angle =", dp2(angle), "radius=", dp2(radius))
-                if radius > 0.3:  # only react if outside the middle circle
-                    # divide in to four quadrants
-                    # allow a separation of 5% of section
-                    gun = 3  # starboard
-                    size = 0.25
-                    a = angle  # map onto quarter
-                    print("try first: angle =", dp2(
-                        angle), "a>.25", angle > 0.25)
-                    if angle > 0.25:  # not 1st quarter
-                        print("not first: angle =", dp2(
-                            angle), "a<.5", angle < 0.5)
-                        gun = 1  # rear starboard
-                        if angle > 0.5:  # not 2nd quarter
-                            print("not second: angle =", dp2(
-                                angle), "a<.75", angle < 0.75)
-                            a = 1 - angle  # map onto other half
-                            gun = 0  # back port
-                            if angle > 0.75:  # not 3rd quarter
-                                print("not third")
-                                gun = 2  # port
-                    print("square: a=", dp2(a), "abs(a)=", dp2(abs(a)),
-                          "size=", size, "new a=", dp2(a - size * a / abs(a)))
-                    if abs(a) > size:
-                        # map angle on to quarter circle
-                        a += -size * a / abs(a)
-                    # abs((2 * a - size) / size) # distance from center of range (size)
-                    d = abs((2 * a / size) - 1)
-                    print("square: gun=", gun, "size=",
-                          size, "a=", dp2(a), "d=", dp2(d))
-                    if d <= 0.9:  # lop off biggest 10% left or right to give separation from other sections
-                        # express a as fraction of 5% - 95% of the size
-                        f = ((a - (0.05 * size)) / 0.9) / size
-                        steps, start, stop, middle = self.guns[gun]
-                        # steps using fraction of full steps
-                        s = int(f * steps)
-                        value = start + s   # convert to step value
-                        print("square: tagetting gun=", gun, "value=", value)
-                        self.boat.target(gun, value)
-            elif self.triangle:  # split three ways
-                if radius > 0.3:  # only react if outside the middle circle
-                    # divide in to front quadrants and back semicircle
-                    # allow a separation of 5% of section
-                    gun = 2  # starboard
-                    size = 0.25
-                    a = angle  # map onto quarter
-                    if angle > 0.25:  # not 1st quarter
-                        gun = 1  # port
-                        a = 1 - angle  # map onto quarter
-                        if angle < 0.75:  # not 4th quarter
-                            gun = 0  # back
-                            size = 0.5
-                            a = angle - 0.25  # map angle on to semicircle
-                    # abs((2 * a - size) / size) # distance from center of range (size)
-                    d = abs((2 * a / size) - 1)
-                    print("triangle: gun=", gun, "size=",
-                          size, "a=", dp2(a), "d=", dp2(d))
-                    if d <= 0.9:  # lop off biggest 10% left or right to give separation from other sections
-                        # express a as fraction of 5% - 95% of the size
-                        f = ((a - (0.05 * size)) / 0.9) / size
-                        steps, start, stop, middle = self.guns[gun]
-                        # steps using fraction of full steps
-                        s = int(f * steps)
-                        value = start + s   # convert to step value
-                        self.boat.target(gun, value)
-            else:  # split into concentric circles
-                # 0 to number of guns+1
-                gun = math.ceil(radius * (len(self.guns) + 1))
-                ### print("concentric: gun=", gun, "angle=", dp2(angle))
-                if gun > 1:  # skip middle bit
-                    self.boat.target(gun - 2, angle)
+            # one to do all guns, looked up in the table from compileAims()
+            a = int(angle * ANGLES + 0.5)
+            if a > ANGLES:
+                a = ANGLES
+            elif a < 0:
+                a = 0
+            aim = self.aims[self.aimBand(radius)][a]
+            if aim:
+                self.boat.target(*aim)
         elif self.targets == 2:
             # more dificult, 2 to split over all
             gun = 0
@@ -315,8 +339,100 @@ class CommsController():
                 self.boat.target(connectionId - 1, angle)
         return
 
-    def double(self, connectionId, x, y):
-        # called by a listener that recieves a double-click at a position
+    def compileAims(self):
+        '''
+        Work out aim() for ANGLES steps of angle, so target() is a lookup.
+
+        aim() only depends on which band the radius is in (see aimBand()),
+        so there is one row of angles for each band, found by looking at
+        RADII steps of radius, and target() looks up the band of the exact radius.
+        Only done again if the guns have changed.
+        '''
+        key = (tuple(self.guns), self.square, self.triangle)
+        if key == self.aimsFor:
+            return
+        aims = {}  # band: row of aims
+        for r in range(RADII + 1):
+            radius = r / RADII
+            band = self.aimBand(radius)
+            if band not in aims:
+                aims[band] = [self.aim(radius, a / ANGLES) for a in range(ANGLES + 1)]
+        self.aims = aims
+        self.aimsFor = key
+        return
+
+    def aimBand(self, radius):
+        '''
+        Which band of radius aim() treats alike.
+        '''
+        if self.square or self.triangle:
+            return radius > 0.3  # only react if outside the middle circle
+        return math.ceil(radius * (len(self.guns) + 1))
+
+    def aim(self, radius, angle):
+        '''
+        The (gun, value) for one connection doing all the guns to target at
+        radius and angle (as from xy2ra()), or None if none should move.
+        '''
+        if self.square:  # split four ways
+            if radius > 0.3:  # only react if outside the middle circle
+                # divide in to four quadrants
+                # allow a separation of 5% of section
+                gun = 3  # starboard
+                size = 0.25
+                a = angle  # map onto quarter
+                if angle > 0.25:  # not 1st quarter
+                    gun = 1  # rear starboard
+                    if angle > 0.5:  # not 2nd quarter
+                        a = 1 - angle  # map onto other half
+                        gun = 0  # back port
+                        if angle > 0.75:  # not 3rd quarter
+                            gun = 2  # port
+                if abs(a) > size:
+                    # map angle on to quarter circle
+                    a += -size * a / abs(a)
+                # abs((2 * a - size) / size) # distance from center of range (size)
+                d = abs((2 * a / size) - 1)
+                if d <= 0.9:  # lop off biggest 10% left or right to give separation from other sections
+                    # express a as fraction of 5% - 95% of the size
+                    f = ((a - (0.05 * size)) / 0.9) / size
+                    steps, start, stop, middle = self.guns[gun]
+                    # steps using fraction of full steps
+                    s = int(f * steps)
+                    value = start + s   # convert to step value
+                    return gun, value
+        elif self.triangle:  # split three ways
+            if radius > 0.3:  # only react if outside the middle circle
+                # divide in to front quadrants and back semicircle
+                # allow a separation of 5% of section
+                gun = 2  # starboard
+                size = 0.25
+                a = angle  # map onto quarter
+                if angle > 0.25:  # not 1st quarter
+                    gun = 1  # port
+                    a = 1 - angle  # map onto quarter
+                    if angle < 0.75:  # not 4th quarter
+                        gun = 0  # back
+                        size = 0.5
+                        a = angle - 0.25  # map angle on to semicircle
+                # abs((2 * a - size) / size) # distance from center of range (size)
+                d = abs((2 * a / size) - 1)
+                if d <= 0.9:  # lop off biggest 10% left or right to give separation from other sections
+                    # express a as fraction of 5% - 95% of the size
+                    f = ((a - (0.05 * size)) / 0.9) / size
+                    steps, start, stop, middle = self.guns[gun]
+                    # steps using fraction of full steps
+                    s = int(f * steps)
+                    value = start + s   # convert to step value
+                    return gun, value
+        else:  # split into concentric circles
+            # 0 to number of guns+1
+            gun = math.ceil(radius * (len(self.guns) + 1))
+            if gun > 1:  # skip middle bit
+                return gun - 2, angle
+        return None
+
+    def doubled(self, connectionId, x, y):
         # allow doble click to swap listener from Navigate to Target and back
         listener = self.listeners[connectionId]
         newId = 1 - connectionId  # swap to the other
@@ -330,6 +446,119 @@ class CommsController():
         return
 
 
+class CountingBoat():
+    '''
+    A stand in boat for trying out controllers and their transports,
+    counting how often it is navigated and keeping the last position.
+    '''
+    guns = ()
+
+    def __init__(self):
+        self.navigated = 0
+        self.x, self.y = 0, 0
+        return
+
+    def centerGuns(self):
+        return
+
+    def navigate(self, x, y):
+        self.navigated += 1
+        self.x, self.y = x, y
+        return
+
+
+class Dispatcher(Thread):
+    '''
+    Delivers listener events to the controller from a single thread.
+
+    Each connection has a mailbox of events waiting to be delivered.
+    A move replaces any move still waiting at the end of its mailbox,
+    so however fast moves arrive only the latest is handled,
+    while presses, lifts and doubles are all delivered in order.
+    Mailboxes are taken in turn, each being emptied in one go.
+    Once stopped it still delivers everything already posted.
+    dispatcher.posted and dispatcher.delivered count the events.
+    '''
+
+    def __init__(self, controller):
+        Thread.__init__(self, daemon=True)
+        self.controller = controller
+        self.mail = Condition()
+        self.mailboxes = {}  # connectionId: [[kind, x, y], ...]
+        self.ready = deque()  # connectionIds with mail, in order
+        self.posted = 0
+        self.delivered = 0
+        self.ok = True
+        return
+
+    def post(self, connectionId, kind, x, y):
+        with self.mail:
+            self.posted += 1
+            mailbox = self.mailboxes.get(connectionId)
+            if mailbox:
+                last = mailbox[-1]
+                if kind == "move" and last[0] == "move":
+                    last[1] = x  # overwrite the waiting move
+                    last[2] = y
+                    return
+            else:
+                mailbox = self.mailboxes[connectionId] = []
+                self.wake(connectionId)
+            mailbox.append([kind, x, y])
+        return
+
+    def wake(self, connectionId):
+        # connectionId has mail, called holding self.mail
+        self.ready.append(connectionId)
+        self.mail.notify()
+        return
+
+    def take(self, connectionId):
+        # all the events waiting for connectionId, or None
+        with self.mail:
+            return self.mailboxes.pop(connectionId, None)
+
+    def deliver(self, connectionId, events):
+        for kind, x, y in events:
+            self.delivered += 1
+            try:
+                self.controller.deliver(connectionId, kind, x, y)
+            except Exception as e:
+                print("Dispatcher exception:", e)
+        return
+
+    def discard(self, connectionId):
+        # forget the moves and doubles waiting for a connection that has gone,
+        # its presses and lifts are still delivered in order
+        with self.mail:
+            mailbox = self.mailboxes.get(connectionId)
+            if mailbox:
+                mailbox[:] = [event for event in mailbox if event[0] in ("press", "lift")]
+                if not mailbox:
+                    del self.mailboxes[connectionId]
+        return
+
+    def stop(self):
+        # stop once everything already posted has been delivered
+        with self.mail:
+            self.ok = False
+            self.mail.notify()
+        return
+
+    def run(self):
+        while True:
+            with self.mail:
+                while self.ok and not self.ready:
+                    self.mail.wait()
+                if not self.ready:
+                    break  # stopped, and all delivered
+                connectionId = self.ready.popleft()
+            events = self.take(connectionId)
+            if events:  # not discarded
+                self.deliver(connectionId, events)
+        return
+
+
 class CommsServer(Thread):
     '''
     This is a server generatine listeners from connections.
@@ -487,11 +716,11 @@ class CommsListener(Thread):
         # print("CommsListener.run()")
         while self.ok:
             try:
-                ### print("Waiting for message")
-                message = self.receiver.getMessage()
-                ### print("Message received, trying to execute ...")
-                if message:
-                    self.execute(message)
+                ### print("Waiting for messages")
+                messages = self.receiver.getMessages()
+                ### print("Messages received, trying to execute ...")
+                if messages:
+                    self.executeAll(messages)
                 else:
                     self.ok = False
             except Exception as e:
@@ -502,6 +731,16 @@ class CommsListener(Thread):
             self.controller.disconnected(self.connectionId)
         return
 
+    def executeAll(self, messages):
+        # execute a batch of messages, only the last of a run of moves matters
+        last = len(messages) - 1
+        for i in range(last + 1):
+            message = messages[i]
+            if i < last and self.isMove(message) and self.isMove(messages[i + 1]):
+                continue
+            self.execute(message)
+        return
+
     #
     # these should be overridden
     #
@@ -510,6 +749,10 @@ class CommsListener(Thread):
         # turn a connection into the receiver
         return MessageReceiver(setup=connection)
 
+    def isMove(self, message):
+        # is the message a move, that a following move can replace
+        return message[0].lower() == "m"
+
     def execute(self, message):
         # should be overridden
         x = 1
@@ -544,6 +787,14 @@ class MessageReceiver():
         # wait for a message and return it
         return None
 
+    def getMessages(self):
+        # wait for a message and return a list of it and any others
+        # already available, an empty list when closed
+        message = self.getMessage()
+        if message:
+            return [message]
+        return []
+
     def close(self):
         ### print("MessageReciever.close() does nothing!")
         return
@@ -570,63 +821,64 @@ if __name__ == '__main__':
     server2 = CommsServer(None)
     controller.addServer(server2)
     '''
-    x, y = 0.01, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 0.5, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, .5
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, .01
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, -.01
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, -.5
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 1, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = .5, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = 0.01, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -0.01, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -0.5, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, -1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, -.5
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, -0.01
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, 0.01
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, .5
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -1, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -.5, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
-    x, y = -0.01, 1
-    r, a = xy2ra(x, y)
-    print((dp2(x), dp2(y)), dp2(r), dp2(a))
+    def oldXy2ra(x, y):
+        # the atan version xy2ra() replaced, which fails when y is 0
+        a = 0
+        r = math.sqrt(x * x + y * y)
+        if r > 1.0:
+            r = 1.0
+        if r > 0.1:  # angle only relevant if a distance from the center!
+            ax, ay = abs(a), abs(y)
+            sx = sy = 1  # +ve
+            if x < 0:
+                sx = -1
+            if y < 0:
+                sy = -1
+            ss = sx * sy
+            # to avoid divide by zero and rediculously big numbers ...
+            if ax > ay:
+                f = y / x
+                aTanXY = math.atan(f) / math.pi
+                aTanXY = ss * (1 - aTanXY)
+            else:
+                f = x / y
+                aTanXY = math.atan(f) / math.pi
+            h = ((1 - sx) + (1 - ss)) / 2  # I call it the half number
+            a = (h + aTanXY) / 2
+        return r, a
+
+    samples = ((0.01, 1), (0.5, 1), (1, 1), (1, .5), (1, .01), (1, -.01),
+               (1, -.5), (1, -1), (.5, -1), (0.01, -1), (-0.01, -1), (-0.5, -1),
+               (-1, -1), (-1, -.5), (-1, -0.01), (-1, 0.01), (-1, .5), (-1, 1),
+               (-.5, 1), (-0.01, 1))
+    differences = 0
+    for x, y in samples:
+        r, a = xy2ra(x, y)
+        print((dp2(x), dp2(y)), dp2(r), dp2(a))
+        oldR, oldA = oldXy2ra(x, y)
+        if abs(r - oldR) > 1e-12 or abs(a - oldA) > 1e-12:
+            print("differs from old:", dp2(oldR), dp2(oldA))
+            differences += 1
+    print("differences from old at the samples:", differences)
+    print("on the x axis:", xy2ra(1, 0), xy2ra(-1, 0), "(old divides by zero)")
+
+    from time import perf_counter
+    count = 100000
+    points = [samples[i % len(samples)] for i in range(count)]
+    for name, function in (("old", oldXy2ra), ("xy2ra", xy2ra)):
+        start = perf_counter()
+        for x, y in points:
+            function(x, y)
+        taken = perf_counter() - start
+        print("%s: %.3f us each" % (name, 1e6 * taken / count))
+    if numpy:
+        xs = numpy.array([p[0] for p in points])
+        ys = numpy.array([p[1] for p in points])
+        start = perf_counter()
+        rs, angles = xy2raArrays(xs, ys)
+        taken = perf_counter() - start
+        print("xy2raArrays: %.3f us each" % (1e6 * taken / count))
+        r, a = zip(*(xy2ra(x, y) for x, y in points))
+        print("xy2raArrays matches xy2ra:",
+              numpy.allclose(rs, r, rtol=0, atol=1e-12) and
+              numpy.allclose(angles, a, rtol=0, atol=1e-12))
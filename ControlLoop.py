@@ -0,0 +1,123 @@
+# !/usr/bin/python3
+"""
+ControlLoop - drive a boat's motors and rudder at a fixed rate.
+
+Joystick positions can arrive as fast as the phone sends them,
+so rather than set the motors on every one, the latest position is
+just recorded and a control loop thread samples it at a fixed rate,
+mixes it and moves each output towards its new setting,
+limited by a slew rate so the motors and servo are not jerked about.
+"""
+
+from threading import Thread, Lock
+from time import sleep, monotonic
+
+
+class ControlLoop(Thread):
+    '''
+    ControlLoop(boat, rate, slew)
+    Where "boat" provides mix(x, y) giving (left, right, center, rudder)
+    and drive(left, right, center, rudder) to set them,
+    "rate" is the number of ticks per second (default 50)
+    and "slew" is a tuple of the most each of (left, right, center, rudder)
+    may change by in a second (default SLEW), None for no limit.
+
+    loop.request(x, y) records the latest joystick position.
+    loop.halt() stops everything straight away (no slew).
+    loop.stop() ends the loop thread.
+    After each tick boat.whenDriven() is called, if the boat has one set,
+    e.g. to report the new state.
+    If a tick fails the boat is stopped and the loop ends,
+    so the boat goes back to setting outputs on each navigate().
+    '''
+
+    SLEW = (4.0, 4.0, 4.0, 8.0)  # full stop to full ahead in 1/4 second, rudder twice as fast
+
+    def __init__(self, boat, rate=50, slew=None):
+        Thread.__init__(self, daemon=True)
+        self.boat = boat
+        self.period = 1.0 / rate
+        if slew is None:
+            slew = self.SLEW
+        # most each output can move in one tick
+        self.steps = tuple(None if s is None else s * self.period for s in slew)
+        self.lock = Lock()
+        self.requested = (0.0, 0.0)  # latest joystick position
+        self.outputs = [0.0, 0.0, 0.0, 0.0]  # what we last set
+        self.ticks = 0  # number of ticks that set the outputs
+        self.ok = True
+        return
+
+    def request(self, x, y):
+        self.requested = (x, y)  # just the latest wins
+        return
+
+    def halt(self):
+        '''
+        Forget the joystick and take the outputs as stopped.
+        '''
+        with self.lock:
+            self.requested = (0.0, 0.0)
+            self.outputs = [0.0, 0.0, 0.0, 0.0]
+        return
+
+    def stop(self):
+        self.ok = False
+        return
+
+    def run(self):
+        due = monotonic()
+        while self.ok:
+            try:
+                self.tick()
+            except Exception as e:
+                print("ControlLoop exception, stopping the boat:", e)
+                self.ok = False
+                if self.boat.loop is self:
+                    self.boat.loop = None
+                self.boat.stop()
+                break
+            self.report()
+            due += self.period
+            delay = due - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:  # fallen behind, so don't try to catch up
+                due = monotonic()
+        return
+
+    def tick(self):
+        '''
+        Move the outputs towards the mix for the latest joystick position and set them.
+        '''
+        x, y = self.requested
+        targets = self.boat.mix(x, y)
+        with self.lock:
+            outputs = self.outputs
+            for i in range(len(outputs)):
+                change = targets[i] - outputs[i]
+                step = self.steps[i]
+                if step is not None:
+                    if change > step:
+                        change = step
+                    elif change < -step:
+                        change = -step
+                output = outputs[i] + change
+                if output > 1.0:
+                    output = 1.0
+                elif output < -1.0:
+                    output = -1.0
+                outputs[i] = output
+            self.boat.drive(*outputs)
+            self.ticks += 1
+        return
+
+    def report(self):
+        # let the boat tell anyone interested, without stopping the loop if they fail
+        whenDriven = getattr(self.boat, "whenDriven", None)
+        if whenDriven:
+            try:
+                whenDriven()
+            except Exception as e:
+                print("ControlLoop report exception:", e)
+        return
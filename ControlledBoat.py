@@ -9,6 +9,7 @@ have a listener display the status of the boat.
 import math
 import sys
 
+from AsyncComms import AsyncController
 from CommsController import CommsController
 
 
@@ -37,6 +38,10 @@ class ControlledBoat(CommsController):
 
         # add in any listener
         self.boatListeners = []
+        self.reported = None  # boat version last reported
+        if boat is not None:
+            # a control loop sets the outputs later, so reports after it has
+            boat.whenDriven = self.report
         if listener:
             self.addBoatListener(listener)
         return
@@ -49,7 +54,12 @@ class ControlledBoat(CommsController):
 
     def report(self):
         if self.boat and len(self.boatListeners) > 0:
-            values = self.boat.report()
+            # only bother the listeners if something has changed
+            version = self.boat.refresh()
+            if version == self.reported:
+                return
+            self.reported = version
+            values = self.boat.state
             for listener in self.boatListeners:
                 # let each listener get the data
                 listener.update(*values)
@@ -69,10 +79,19 @@ class ControlledBoat(CommsController):
     def navigate(self, connectionId, x, y):
         super().navigate(connectionId, x, y)
         # then report oy back up to the boat listeners
-        self.report()
+        # (unless the boat's control loop will once it has set the outputs)
+        if not self.boat.loop:
+            self.report()
         return
 
 
+class AsyncControlledBoat(AsyncController, ControlledBoat):
+    '''
+    A ControlledBoat whose comms all run on the shared event loop
+    (see AsyncComms), use with asynchronous servers like AsyncBdServer.
+    '''
+
+
 if __name__ == '__main__':
     def waitABit():
         print("Wait a bit")
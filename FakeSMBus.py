@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# FakeSMBus.py - an in-process stand-in for smbus.SMBus to run the turrets off the Pi
+"""
+FakeSMBus records every transaction, with a timestamp,
+and holds the register values written so they can be read back.
+It can also simulate the time the real bus takes,
+so the stepping engine can be benchmarked (and checked) on any Linux box.
+Steppers (FakeStepper) can be attached to the outputs of an expander
+to follow the phases written and work an end stop switch on an input,
+so homing with end stops can be tried too.
+
+To use it:
+   from Turret import setBusFactory
+   setBusFactory(FakeSMBus)
+before any Turret is created.
+"""
+
+from threading import Lock
+from time import sleep, monotonic
+
+
+class FakeSMBus():
+    '''
+    FakeSMBus(number, latency, clock)
+    Where "number" is the bus number (ignored),
+    "latency" is a fixed time (seconds) each transaction takes
+    and "clock" is the bus speed (Hz) used to add the time to clock out
+    the bytes (address, register and data, 9 bits each with the ack).
+    A clock of 0 (the default) and latency of 0 makes every transaction free.
+
+    Every transaction is recorded in self.transactions as a tuple of:
+       (time, kind, device, register, data)
+    where kind is "byte", "word" or "block" followed by " read" for reads.
+
+    Inputs are set with setInput(), which also raises the MCP23017
+    interrupt flags (INTF / INTCAP) as configured, and reading INTCAP or GPIO
+    clears them as the chip does.
+    '''
+
+    # MCP23017 registers (port A, port B is the next one)
+    GPINTENA = 0x04
+    DEFVALA = 0x06
+    INTCONA = 0x08
+    INTFA = 0x0E
+    INTCAPA = 0x10
+    GPIOA = 0x12
+    OLATA = 0x14
+
+    def __init__(self, number=1, latency=0.0, clock=0):
+        self.number = number
+        self.latency = latency
+        self.clock = clock
+        self.lock = Lock()  # the real bus only does one thing at a time
+        self.transactions = []
+        self.registers = {}  # (device, register) -> last value
+        self.busy = 0.0  # total time spent in transactions
+        self.steppers = []
+        return
+
+    def addStepper(self, device, nibble, position, **kwargs):
+        '''
+        Attach a FakeStepper to nibble (0 to 3) of the expander at device.
+        '''
+        stepper = FakeStepper(self, device, nibble, position, **kwargs)
+        self.steppers.append(stepper)
+        return stepper
+
+    def setInput(self, device, pin, level):
+        '''
+        Set input pin (0 to 15) of the expander at device to level (0 or 1).
+        '''
+        register = self.GPIOA + pin // 8
+        bit = 1 << (pin % 8)
+        old = self.registers.get((device, register), 0)
+        new = old & ~bit
+        if level:
+            new |= bit
+        self.registers[(device, register)] = new
+        offset = pin // 8
+        enabled = self.registers.get((device, self.GPINTENA + offset), 0) & bit
+        if enabled and new != old:
+            if self.registers.get((device, self.INTCONA + offset), 0) & bit:
+                default = self.registers.get((device, self.DEFVALA + offset), 0)
+                interrupt = (new & bit) != (default & bit)
+            else:
+                interrupt = True  # any change
+            if interrupt:
+                flags = self.registers.get((device, self.INTFA + offset), 0)
+                self.registers[(device, self.INTFA + offset)] = flags | bit
+                self.registers[(device, self.INTCAPA + offset)] = new
+        return
+
+    def written(self, device, register, count):
+        '''
+        Let any steppers know their outputs may have changed.
+        '''
+        if self.steppers and register < self.OLATA + 2 and register + count > self.OLATA:
+            word = (self.registers.get((device, self.OLATA), 0)
+                    | self.registers.get((device, self.OLATA + 1), 0) << 8)
+            for stepper in self.steppers:
+                if stepper.device == device:
+                    stepper.output(word)
+        return
+
+    def read(self, device, register, count):
+        '''
+        Reading INTCAP or GPIO clears the interrupt for that port.
+        '''
+        for offset in range(2):
+            for base in (self.INTCAPA, self.GPIOA):
+                if register <= base + offset < register + count:
+                    self.registers[(device, self.INTFA + offset)] = 0
+        return
+
+    def transaction(self, kind, device, register, data, size):
+        '''
+        Record the transaction and take as long as the bus would.
+        '''
+        with self.lock:
+            start = monotonic()
+            self.transactions.append((start, kind, device, register, data))
+            delay = self.latency
+            if self.clock:
+                delay += (2 + size) * 9 / self.clock
+            if delay > 0:
+                sleep(delay)
+            self.busy += monotonic() - start
+        return
+
+    def reset(self):
+        '''
+        Forget all the transactions so far.
+        '''
+        with self.lock:
+            self.transactions = []
+            self.busy = 0.0
+        return
+
+    def count(self, kind=None):
+        '''
+        Number of transactions so far, optionally of only one kind.
+        '''
+        if not kind:
+            return len(self.transactions)
+        return len([t for t in self.transactions if t[1] == kind])
+
+    def write_byte_data(self, device, register, value):
+        self.registers[(device, register)] = value & 0xFF
+        self.transaction("byte", device, register, value, 1)
+        self.written(device, register, 1)
+        return
+
+    def write_word_data(self, device, register, value):
+        self.registers[(device, register)] = value & 0xFF
+        self.registers[(device, register + 1)] = (value >> 8) & 0xFF
+        self.transaction("word", device, register, value, 2)
+        self.written(device, register, 2)
+        return
+
+    def write_i2c_block_data(self, device, register, values):
+        for i in range(len(values)):
+            self.registers[(device, register + i)] = values[i] & 0xFF
+        self.transaction("block", device, register, tuple(values), len(values))
+        self.written(device, register, len(values))
+        return
+
+    def read_byte_data(self, device, register):
+        value = self.registers.get((device, register), 0)
+        self.transaction("byte read", device, register, value, 1)
+        self.read(device, register, 1)
+        return value
+
+    def read_word_data(self, device, register):
+        value = (self.registers.get((device, register), 0)
+                 | self.registers.get((device, register + 1), 0) << 8)
+        self.transaction("word read", device, register, value, 2)
+        self.read(device, register, 2)
+        return value
+
+    def read_i2c_block_data(self, device, register, length):
+        values = [self.registers.get((device, register + i), 0) for i in range(length)]
+        self.transaction("block read", device, register, tuple(values), length)
+        self.read(device, register, length)
+        return values
+
+
+class FakeStepper():
+    '''
+    A stepper on one nibble of a fake expander, following the phases written.
+
+    "position" is where it really is to start with,
+    "phases" the phase table it is driven with (default wave),
+    "low" the hard stop it cannot be driven below
+    and "endstop" the input pin of a switch that is active (pulled low
+    if activeLow) whenever the stepper is at or below "switchAt".
+    '''
+
+    def __init__(self, bus, device, nibble, position, phases=(1, 2, 4, 8),
+                 low=None, endstop=None, switchAt=0, activeLow=True):
+        self.bus = bus
+        self.device = device
+        self.nibble = nibble
+        self.position = position
+        self.phases = phases
+        self.low = low
+        self.endstop = endstop
+        self.switchAt = switchAt
+        self.activeLow = activeLow
+        self.phase = position % len(phases)  # rotor sits on this phase
+        self.steps = 0  # steps actually made
+        self.switch()
+        return
+
+    def output(self, word):
+        nibble = (word >> (self.nibble * 4)) & 0x0F
+        if nibble not in self.phases:
+            return  # off (or nonsense), so stays put
+        count = len(self.phases)
+        phase = self.phases.index(nibble)
+        turn = (phase - self.phase) % count
+        if turn == 1:
+            step = 1
+        elif turn == count - 1:
+            step = -1
+        else:
+            return  # no change, or too far to follow
+        if self.low is not None and self.position + step < self.low:
+            return  # against the hard stop, so the rotor slips back
+        self.phase = phase
+        self.position += step
+        self.steps += 1
+        self.switch()
+        return
+
+    def switch(self):
+        if self.endstop is None:
+            return
+        active = self.position <= self.switchAt
+        self.bus.setInput(self.device, self.endstop, int(active != self.activeLow))
+        return
+
+
+def benchmark(turrets=4, steps=40, latency=0.0002, clock=100000):
+    '''
+    Sweep turrets together on a fake 100 kHz bus and report what it cost.
+    '''
+    import Turret
+    bus = FakeSMBus(1, latency=latency, clock=clock)
+    Turret.setBusFactory(lambda number: bus)
+    guns = []
+    for i in range(turrets):
+        address = (i // 4, (i // 2) % 2, i % 2)
+        guns.append(Turret.Turret(steps, address))
+    bus.reset()
+    start = monotonic()
+    for gun in guns:
+        gun.set(steps)
+    for gun in guns:
+        gun.wait()
+    elapsed = monotonic() - start
+    positions = [gun.step for gun in guns]
+    print("turrets:", turrets, "steps:", steps, "positions:", positions)
+    print("took", format(elapsed, "0.3f"), "s",
+          "transactions:", bus.count(),
+          "bus busy:", format(bus.busy, "0.4f"), "s")
+    for gun in guns:
+        gun.requestStop()
+    for gun in guns:
+        gun.waitForStop()
+    Turret.buses.clear()  # so the next run starts afresh
+    Turret.mcp[0] = Turret.mcp[1] = None
+    return positions == [steps] * turrets, bus
+
+
+def homing(size=40, start=13, endstop=15):
+    '''
+    Home a turret with an end stop switch and check it ends up at 0.
+    '''
+    import Turret
+    bus = FakeSMBus(1)
+    Turret.setBusFactory(lambda number: bus)
+    stepper = bus.addStepper(Turret.MCP23017.DEVICE, 0, start,
+                             low=-2, endstop=endstop, switchAt=0)
+    gun = Turret.Turret(size, (0, 0, 0), endstop=endstop)
+    begin = monotonic()
+    gun.reset()
+    gun.wait()
+    elapsed = monotonic() - begin
+    print("homed from", start, "in", stepper.steps, "steps",
+          format(elapsed, "0.3f"), "s, now at", stepper.position,
+          "thinks", gun.step)
+    gun.requestStop()
+    gun.waitForStop()
+    Turret.buses.clear()
+    Turret.mcp[0] = Turret.mcp[1] = None
+    return stepper.position == gun.step == 0, bus
+
+
+if __name__ == "__main__":
+    for number in (1, 4, 8):
+        ok, bus = benchmark(turrets=number)
+        if not ok:
+            print("FAILED - turrets did not all reach their target")
+    ok, bus = homing()
+    if not ok:
+        print("FAILED - turret did not home to 0")
@@ -11,16 +11,59 @@ they had to be implemented in a more specific way.
 """
 
 import math
+from array import array
 
 from gpiozero import SourceMixin, CompositeDevice, Motor, Servo, Pin, Device, GPIOPinMissing
 
-from Turret import Turret
+from Calibration import Calibration
+from ControlLoop import ControlLoop
+from MixingTable import MixingTable
+from Turret import Turret, resetAll
 
 
 def dp2(number):
     return format(number, "03.2f")
 
 
+class OutputCache():
+    '''
+    OutputCache(outputs, epsilon)
+    Remembers the value last written to each of the gpiozero "outputs"
+    (None for any that are missing) and skips any write that would change
+    it by no more than "epsilon", counting the writes made and elided.
+    A change to exactly 0 is always written so things really stop.
+    '''
+
+    def __init__(self, outputs, epsilon=0.005):
+        self.outputs = tuple(outputs)
+        self.values = [None] * len(self.outputs)
+        self.epsilon = epsilon
+        self.writes = 0
+        self.elided = 0
+        return
+
+    def set(self, index, value):
+        output = self.outputs[index]
+        if output is None:
+            return
+        last = self.values[index]
+        if last is not None and abs(value - last) <= self.epsilon:
+            if value != 0 or last == 0:
+                self.elided += 1
+                return
+        output.value = value
+        self.values[index] = value
+        self.writes += 1
+        return
+
+    def forget(self):
+        '''
+        Outputs have been set some other way, so write them next time.
+        '''
+        self.values = [None] * len(self.outputs)
+        return
+
+
 def checkMotor(name, pins, pwm=True, pin_factory=None):
     ### print("checkMotor:", name, pins, pwm, pin_factory)
     motor = None
@@ -206,6 +249,8 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         self.rightDelta = 1.0
         self.centerDelta = 1.0
         self.toServo = 1.0
+        self.mixing = None  # optional MixingTable
+        self.curves = None  # optional Calibration curves
 
         # initialise the motors and servo
         if self.left_motor:
@@ -215,8 +260,22 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         if self.center_motor:
             self.center_motor.stop()
         self.rudder.mid()
+        # only write outputs that have really changed
+        outputs = (self.left_motor, self.right_motor, self.center_motor, self.rudder)
+        self.cache = OutputCache(outputs)
+        # output cache index for each motor and then the rudder in a frame
+        self.frameSlots = tuple(i for i in range(len(outputs)) if outputs[i])
         # LimmitedSteppers are assumed to be in default position
         self._debug = False
+        self.loop = None  # optional ControlLoop
+        self.whenDriven = None  # called after each control loop tick
+        # preallocated state for report(), bumping version when it changes
+        self.state = array('d', bytes(8 * len(self.pins)))
+        self.version = 0
+        self.pinSlots = tuple(i for i in range(len(self.pins))
+                              if not isinstance(self.pins[i], Turret))
+        self.gunSlots = tuple(i for i in range(len(self.pins))
+                              if isinstance(self.pins[i], Turret))
         return
 
     @property
@@ -232,18 +291,52 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
     # this should be done on the gpioZeroBoat side of things ...
     @value.setter
     def value(self, value):
-        values = tuple(value)
-        for motor in self.motors:
-            motor.value = values[0]
-            values = values[1:]
-        self.rudder.value = values[0]
-        values = values[1:]
-        for turret in self.guns:
-            turret.set(values[0])
-            values = values[1:]
+        self.applyFrame(value)
         self.debug("set value:", self.value)
         return
 
+    def newFrame(self):
+        """
+        A new (all stopped) frame for applyFrame().
+
+        An array of a value for each motor (in order left, right and center),
+        then the rudder and then a target position for each gun.
+        Keep it and fill it in for each frame rather than making a new one.
+        """
+        return array('d', bytes(8 * (len(self.frameSlots) + len(self.guns))))
+
+    def applyFrame(self, frame):
+        """
+        Set all the motors, the rudder and the gun targets from frame in one pass.
+
+        frame is laid out as for newFrame(), any sequence will do.
+        Motors and rudder go through any calibration curves (as for drive())
+        and the output cache, and guns are only given their target if it has
+        changed, which the turret engines then move to in the background.
+        This sets the outputs directly, so stop any control loop first.
+        """
+        cache = self.cache
+        slots = self.frameSlots
+        count = len(slots)
+        curves = self.curves
+        if curves:
+            values = [0.0, 0.0, 0.0, 0.0]  # left, right, center, rudder
+            for i in range(count):
+                values[slots[i]] = frame[i]
+            values = curves.apply(*values)
+            for slot in slots:
+                cache.set(slot, values[slot])
+        else:
+            for i in range(count):
+                cache.set(slots[i], frame[i])
+        guns = self.guns
+        for i in range(min(len(guns), len(frame) - count)):
+            target = int(frame[count + i])
+            gun = guns[i]
+            if gun.position != target:
+                gun.set(target)
+        return
+
     def navigate(self, x, y):
         """
         Control the boat by setting left/right to x , and forward/backward to y.
@@ -263,6 +356,31 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         The ration of thrust to actual power of the motors is also 
         adjustable / definable to balance any natural imperfections.
            self.leftDelta, self.rightDelta (and possibly) self.centerDelta covers this.
+        If a control loop is running (see startControlLoop()) the position
+        is just handed to it, and it sets the motors on its next tick.
+        """
+        if self.loop:
+            self.loop.request(x, y)
+            return
+        self.drive(*self.mix(x, y))
+        return
+
+    def mix(self, x, y):
+        """
+        Work out the (left, right, center, rudder) settings for joystick (x, y).
+
+        Uses the mixing table, if there is one (see useMixingTable()),
+        otherwise works it out with mixJoystick().
+        """
+        if self.mixing:
+            return self.mixing.lookup(x, y)
+        return self.mixJoystick(x, y)
+
+    def mixJoystick(self, x, y):
+        """
+        Mix joystick (x, y) into (left, right, center, rudder) settings.
+
+        See navigate() for how they are mixed.
         """
         left, right, center = y, y, y  # straight ahead
         rudder = x
@@ -292,13 +410,108 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         rudder *= self.toServo
         # print("Actual LRC+:", int(100*left), int(100*right), 
         #       int(100*center), int(100*rudder))
-        if self.left_motor:
-            self.left_motor.value = left
-        if self.right_motor:
-            self.right_motor.value = right
-        if self.center_motor:
-            self.center_motor.value = center
-        self.rudder.value = rudder
+        return left, right, center, rudder
+
+    def calibration(self):
+        """
+        The balancing ratios as (thrustDelta, leftDelta, rightDelta, centerDelta, toServo).
+        """
+        return (self.thrustDelta, self.leftDelta, self.rightDelta,
+                self.centerDelta, self.toServo)
+
+    def setCalibration(self, **ratios):
+        """
+        Change any of the balancing ratios, e.g. setCalibration(leftDelta=0.9).
+
+        Rebuilds any mixing table, so use this rather than setting them directly.
+        """
+        for name, ratio in ratios.items():
+            if name not in ("thrustDelta", "leftDelta", "rightDelta",
+                            "centerDelta", "toServo"):
+                raise TypeError('unexpected argument %s' % name)
+            setattr(self, name, ratio)
+        if self.mixing and self.mixing.calibration != self.calibration():
+            self.useMixingTable(self.mixing.size)
+        return
+
+    def useMixingTable(self, size=101):
+        """
+        Mix joystick positions by looking them up in a precomputed table.
+
+        Positions are rounded to a grid of size points each way (see MixingTable),
+        a size of 0 goes back to working each one out.
+        """
+        if size:
+            self.mixing = MixingTable(self, size)
+        else:
+            self.mixing = None
+        return
+
+    def useCalibration(self, path):
+        """
+        Calibrate the motors and rudder with the curves in the JSON file path
+        (see Calibration), applied after mixing, or None to stop using them.
+        """
+        if path:
+            self.curves = Calibration(path)
+        else:
+            self.curves = None
+        return
+
+    def reloadCalibration(self):
+        """
+        Reread the calibration curves, so they can be changed while running.
+
+        If the file cannot be read or has a bad curve the old curves are kept.
+        Returns True if the new curves are in use.
+        """
+        if not self.curves:
+            return False
+        try:
+            self.curves.reload()
+        except (OSError, ValueError, TypeError, IndexError) as e:
+            print("Calibration not reloaded, keeping the old curves:", e)
+            return False
+        return True
+
+    def drive(self, left, right, center, rudder):
+        """
+        Set the motors and rudder to the given values.
+
+        They go through any calibration curves first, and then any that have
+        not changed by more than self.cache.epsilon are not written.
+        """
+        if self.curves:
+            left, right, center, rudder = self.curves.apply(left, right, center, rudder)
+        cache = self.cache
+        cache.set(0, left)
+        cache.set(1, right)
+        cache.set(2, center)
+        cache.set(3, rudder)
+        return
+
+    def startControlLoop(self, rate=50, slew=None):
+        """
+        Run the motors and rudder from a fixed rate control loop.
+
+        From then on navigate() only records the latest joystick position,
+        and the loop mixes it and sets the outputs once a tick (rate per second),
+        changing each by no more than its slew rate (see ControlLoop).
+        """
+        if not self.loop:
+            self.loop = ControlLoop(self, rate=rate, slew=slew)
+            self.loop.start()
+        return
+
+    def stopControlLoop(self):
+        """
+        Stop any control loop, going back to setting outputs on each navigate().
+        """
+        loop = self.loop
+        if loop:
+            self.loop = None
+            loop.stop()
+            loop.join()
         return
 
     def target(self, gun, angle):
@@ -315,13 +528,32 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         return
 
     def centerGuns(self):
-        # one time centering of all guns
+        # one time centering of all guns, all at once and without waiting,
+        # so we can navigate while they home
         if not self.centered:
             self.centered = True
-            for gun in range(len(self.guns)):
-                self.guns[gun].reset()
+            resetAll(self.guns)
         return
 
+    @property
+    def homing(self):
+        '''
+        True while any of the guns is still centering.
+        '''
+        for gun in self.guns:
+            if gun.homing:
+                return True
+        return False
+
+    def waitForGuns(self, timeout=None):
+        '''
+        Wait for all the guns to stop moving, False if timed out.
+        '''
+        for gun in self.guns:
+            if not gun.wait(timeout):
+                return False
+        return True
+
     def forward(self, speed=1, **kwargs):
         """
         Drive the boat forward by running all motors forward.
@@ -425,6 +657,7 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         robot is turning left at half-speed, it will turn right at half-speed.
         If the robot is currently stopped it will remain stopped.
         """
+        self.cache.forget()
         self.left_motor.reverse()
         self.right_motor.reverse()
         self.center_motor.reverse()
@@ -436,6 +669,9 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
         """
         Stop the boat.
         """
+        if self.loop:  # so it does not start them again
+            self.loop.halt()
+        self.cache.forget()
         self.left_motor.stop()
         self.right_motor.stop()
         self.center_motor.stop()
@@ -456,17 +692,39 @@ class GPIOZeroBoat(SourceMixin, CompositeDevice):
             print(*args)
         return
 
+    def refresh(self):
+        '''
+        Bring self.state up to date with the pins and return self.version.
+
+        The state is updated in place and the version only moves on
+        if any of the values in it have changed.
+        '''
+        state = self.state
+        pins = self.pins
+        changed = False
+        for i in self.pinSlots:
+            value = pins[i].state
+            if state[i] != value:
+                state[i] = value
+                changed = True
+        for i in self.gunSlots:
+            value = pins[i].position  # use current position
+            if state[i] != value:
+                state[i] = value
+                changed = True
+        if changed:
+            self.version += 1
+        return self.version
+
     def report(self):
         '''
-        Report on the state of this device as list of pin values.
+        Report on the state of this device as an array of pin values.
+
+        This is self.state, so is reused and changed by later calls,
+        copy it to keep it.
         '''
-        result = []
-        for pin in self.pins:
-            if isinstance(pin, Turret):
-                result.append(pin.position)  # use current position
-            else:
-                result.append(pin.state)
-        return result
+        self.refresh()
+        return self.state
 
 
 if __name__ == '__main__':
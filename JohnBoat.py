@@ -6,13 +6,17 @@ It was created to match the spec for John's model boat.
 Details are listed below.
 """
 
+import os
+import signal
+
 from gpiozero import LED
 
-from BdController import BdServer
-from ControlledBoat import ControlledBoat
+from BdController import BdServer, AsyncBdServer
+from ControlledBoat import ControlledBoat, AsyncControlledBoat
 from DisplayBoat import DisplayBoat
 from GpioZeroBoat import GPIOZeroBoat
 from Turret import Turret
+from TurretJournal import TurretJournal
 
 
 if __name__ == '__main__':
@@ -59,6 +63,7 @@ if __name__ == '__main__':
     '''
 
     noDisplay = False  # True # if don't want a visualisation ...
+    asyncComms = False  # True to run all the comms on one event loop thread
 
     # for 3-pin motors:
     left = (20, 21, 19)
@@ -70,14 +75,16 @@ if __name__ == '__main__':
     switchPin = 16  # used for pi on indicator
 
     # Turret controls
+    # remember where the turrets were left, so homing can be skipped
+    journal = TurretJournal("turrets.journal")
     expandor2 = 0  # should be 1 if 2 expanders ...
     # smaller rear facing port turret - 2nd expander, PortA, ls Nible (from 0 to 8)
-    g1a = Turret(8, (expandor2, 0, 0))
+    g1a = Turret(8, (expandor2, 0, 0), journal=journal)
     # smaller rear facing starboard turret - 2nd expander, PortB, ls Nible (from 0 to 8)
-    g1b = Turret(8, (expandor2, 1, 0))
-    g2 = Turret(8, (0, 0, 0))    # port pair - PortA, ls Nible (from 0 to 8)
+    g1b = Turret(8, (expandor2, 1, 0), journal=journal)
+    g2 = Turret(8, (0, 0, 0), journal=journal)    # port pair - PortA, ls Nible (from 0 to 8)
     # starboard pair - PortB, ls Nible (from 0 to 8)
-    g3 = Turret(8, (0, 1, 0))
+    g3 = Turret(8, (0, 1, 0), journal=journal)
     guns = (g1a, g1b, g2, g3)
 
     print("Boat about to start")
@@ -86,18 +93,32 @@ if __name__ == '__main__':
     boat = GPIOZeroBoat(left, right, center, servo,
                         gun=guns)  # boat with added turrets
     # GPIOZeroBoat is just the boat with no controller ...
+    # set the motors at a steady 50 times a second, however fast the phone sends
+    boat.startControlLoop(rate=50)
+    # motor and rudder curves, "kill -HUP" the boat after changing them
+    if os.path.exists("calibration.json"):
+        boat.useCalibration("calibration.json")
+        signal.signal(signal.SIGHUP, lambda *args: boat.reloadCalibration())
 
     # add a blue dot controller, that knows about double clicking to swap function
-    bdController = BdServer()
+    if asyncComms:
+        bdController = AsyncBdServer()
+        Controlled = AsyncControlledBoat
+    else:
+        bdController = BdServer()
+        Controlled = ControlledBoat
 
     if noDisplay:
         # create a test boat with controller
-        test = ControlledBoat(boat=boat, controller=bdController)
+        test = Controlled(boat=boat, controller=bdController)
     else:
         displayBoat = DisplayBoat()
         # create a test boat with controller
-        test = ControlledBoat(
+        test = Controlled(
             boat=boat, listener=displayBoat, controller=bdController)
+    # no watchdog (setWatchdog()) with Blue Dot: it sends nothing while the stick
+    # is held still, so it would stop the boat when cruising, but losing the
+    # connection lifts the stick and stops the boat anyway
 
     # create a switch
     switch = LED(switchPin)
@@ -115,6 +136,13 @@ if __name__ == '__main__':
         tk = displayBoat.tk
         tk.mainloop()
         test.shutdown()
+    boat.stopControlLoop()
+    # park the turrets so the journal records a clean stop
+    for gun in guns:
+        gun.requestStop()
+    for gun in guns:
+        gun.waitForStop()
+    journal.close()
     print("Boat stopped")
 
     # turn switch off
@@ -0,0 +1,132 @@
+# !/usr/bin/python3
+"""
+MixingTable - precomputed joystick mixing for GPIOZeroBoat.
+
+The mixing of a joystick (x, y) into (left, right, center, rudder)
+settings is a handful of branches and multiplications on every event.
+As it only depends on the calibration, it can be worked out once
+for a grid of (x, y) and then each event is just a lookup of the
+nearest grid point.  The table is built with NumPy if it is available,
+and with the boat's own mixing if not, and is exactly the same
+as the boat's own mixing at the grid points either way.
+"""
+
+try:
+    import numpy
+except ImportError:  # fine, just slower to build
+    numpy = None
+
+
+def mixArrays(x, y, thrustDelta, leftDelta, rightDelta, centerDelta, toServo):
+    '''
+    NumPy version of GPIOZeroBoat.mixJoystick() for arrays of x and y.
+
+    Does the same operations in the same order so the results are identical.
+    '''
+    left = y.copy()
+    right = y.copy()
+    center = y.copy()
+    rudder = x.copy()
+    backward = y < 0
+    cap = numpy.where(backward, 1.0 + y, 1.0 - y)  # max amount we change by
+    turnLeft = x < 0
+    delta = numpy.minimum(numpy.where(turnLeft, -x, x) * thrustDelta, cap)
+    delta = numpy.where(backward, -delta, delta)
+    left = numpy.where(turnLeft, left - delta, left + delta)
+    right = numpy.where(turnLeft, right + delta, right - delta)
+    left *= leftDelta
+    right *= rightDelta
+    center *= centerDelta
+    rudder *= toServo
+    return numpy.stack((left, right, center, rudder), axis=-1)
+
+
+class MixingTable():
+    '''
+    MixingTable(boat, size)
+    Where "boat" provides mixJoystick(x, y) and calibration(),
+    and "size" is the number of grid points along each axis
+    (odd so that 0 is a grid point, default 101 - steps of 0.02).
+
+    table.lookup(x, y) gives (left, right, center, rudder) for the
+    nearest grid point to (x, y), each point being held as a tuple
+    so a lookup is just an index.
+    table.calibration is the calibration it was built for.
+    '''
+
+    def __init__(self, boat, size=101):
+        self.size = size
+        self.half = (size - 1) / 2
+        self.calibration = boat.calibration()
+        if numpy:
+            grid = (numpy.arange(size, dtype=numpy.float64) - self.half) / self.half
+            x, y = numpy.meshgrid(grid, grid, indexing="ij")
+            values = mixArrays(x, y, *self.calibration)
+            self.points = [tuple(point) for point in values.reshape(-1, 4).tolist()]
+        else:
+            self.points = []
+            for i in range(size):
+                x = (i - self.half) / self.half
+                for j in range(size):
+                    y = (j - self.half) / self.half
+                    self.points.append(tuple(boat.mixJoystick(x, y)))
+        return
+
+    def lookup(self, x, y):
+        half = self.half
+        last = self.size - 1
+        i = int((x + 1.0) * half + 0.5)
+        if i < 0:
+            i = 0
+        elif i > last:
+            i = last
+        j = int((y + 1.0) * half + 0.5)
+        if j < 0:
+            j = 0
+        elif j > last:
+            j = last
+        return self.points[i * self.size + j]
+
+
+if __name__ == "__main__":
+    # check the table matches the boat's mixing at every grid point
+    from time import perf_counter
+
+    class Calibrated():
+        # just the mixing from GPIOZeroBoat, without any gpiozero devices
+        from GpioZeroBoat import GPIOZeroBoat
+        mixJoystick = GPIOZeroBoat.mixJoystick
+        calibration = GPIOZeroBoat.calibration
+
+        def __init__(self):
+            self.thrustDelta = 0.7
+            self.leftDelta = 0.95
+            self.rightDelta = 1.0
+            self.centerDelta = 0.9
+            self.toServo = 0.8
+            return
+
+    boat = Calibrated()
+    start = perf_counter()
+    table = MixingTable(boat, size=101)
+    print("built in", format(perf_counter() - start, "0.3f"), "s",
+          "with numpy" if numpy else "without numpy")
+    bad = 0
+    for i in range(table.size):
+        x = (i - table.half) / table.half
+        for j in range(table.size):
+            y = (j - table.half) / table.half
+            if table.lookup(x, y) != tuple(boat.mixJoystick(x, y)):
+                bad += 1
+    print("grid points different:", bad)
+    count = 100000
+    start = perf_counter()
+    for n in range(count):
+        boat.mixJoystick(0.3, -0.45)
+    direct = perf_counter() - start
+    start = perf_counter()
+    for n in range(count):
+        table.lookup(0.3, -0.45)
+    lookup = perf_counter() - start
+    print("per call: mixing", format(direct / count * 1e6, "0.2f"), "us",
+          "lookup", format(lookup / count * 1e6, "0.2f"), "us")
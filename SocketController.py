@@ -0,0 +1,373 @@
+# !/usr/bin/python3
+# SocketController - TCP/UDP controller
+"""
+An implementation of CommsController over TCP or UDP sockets,
+so the boat can be driven from laptops and scripts, and tested over loopback.
+
+Every message is a fixed size binary frame (FRAME, 8 bytes, little endian):
+    opcode         - unsigned byte, one of PRESS, MOVE, LIFT, DOUBLE, CLOSE
+                     (and HELLO from the boat)
+    connection id  - unsigned byte, the id the boat gave the connection
+    x, y           - float16 position, -1.0 to 1.0
+    sequence       - unsigned 16 bit count, wrapping, to drop stale frames
+Any number of frames can be sent together and are decoded as a batch.
+The boat sends a HELLO frame with the connection id when it accepts
+a connection (and again if a double click swaps it).
+"""
+
+import socket
+import struct
+from collections import deque
+from queue import Queue, Empty
+
+from CommsController import CommsServer, CommsListener, CommsReceiver, MessageReceiver
+
+
+FRAME = struct.Struct("<BBeeH")
+PRESS, MOVE, LIFT, DOUBLE, CLOSE, HELLO = range(1, 7)
+
+
+def newer(sequence, last):
+    '''
+    Is sequence after last, allowing for wrapping?
+    '''
+    return last is None or 0 < ((sequence - last) & 0xFFFF) < 0x8000
+
+
+class SocketServer(CommsServer):
+    '''
+    This is a server for socket connections.
+
+    setup is (host, port) to listen on, and udp selects UDP instead of TCP.
+    For UDP each new peer address counts as a new connection.
+    '''
+
+    def __init__(self, setup=("", 5005), udp=False):
+        self.udp = udp
+        super().__init__(setup)
+        return
+
+    def makeReceiver(self):
+        if self.udp:
+            return UdpReceiver(self.setup)
+        return SocketReceiver(self.setup)
+
+    def makeListener(self, connection):
+        listener = None
+        if connection:
+            listener = SocketListener(connection, controller=self.controller)
+        return listener
+
+
+class SocketReceiver(CommsReceiver):
+
+    def setup(self, setup):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(setup)
+        self.socket.listen()
+        self.address = self.socket.getsockname()
+        return
+
+    def accept(self):
+        connection, peer = self.socket.accept()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # wakes the accept
+        except OSError:
+            pass
+        self.socket.close()
+        return
+
+
+class UdpPeer():
+    '''
+    Looks enough like a connected socket to a SocketMessageReceiver,
+    but gets its datagrams from the UdpReceiver.
+    '''
+
+    def __init__(self, receiver, peer):
+        self.receiver = receiver
+        self.peer = peer
+        self.queue = Queue()
+        return
+
+    def recv(self, size, flags=0):
+        if flags & socket.MSG_DONTWAIT:
+            try:
+                return self.queue.get_nowait()
+            except Empty:
+                raise BlockingIOError()
+        return self.queue.get()  # b"" when closed
+
+    def send(self, data):
+        return self.receiver.socket.sendto(data, self.peer)
+
+    def close(self):
+        self.receiver.peers.pop(self.peer, None)
+        self.queue.put(b"")
+        return
+
+
+class UdpReceiver(CommsReceiver):
+
+    def setup(self, setup):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(setup)
+        self.address = self.socket.getsockname()
+        self.peers = {}  # address: UdpPeer
+        return
+
+    def accept(self):
+        # pass datagrams to their peers until a new one turns up
+        while True:
+            data, address = self.socket.recvfrom(65536)
+            if address is None:
+                raise OSError("UDP receiver closed")
+            peer = self.peers.get(address)
+            if peer:
+                peer.queue.put(data)
+            else:
+                peer = self.peers[address] = UdpPeer(self, address)
+                peer.queue.put(data)
+                return peer
+
+    def close(self):
+        for peer in list(self.peers.values()):
+            peer.close()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # wakes the recvfrom
+        except OSError:
+            pass
+        self.socket.close()
+        return
+
+
+class SocketListener(CommsListener):
+    '''
+    Listener for frames from a socket connection.
+    '''
+
+    def makeReceiver(self, connection):
+        return SocketMessageReceiver(setup=connection)
+
+    def startup(self, connectionId, controller):
+        self.sequence = None  # last sequence number seen
+        if self.receiver:
+            # tell the other end who they are
+            self.receiver.send(HELLO, connectionId)
+        return super().startup(connectionId, controller)
+
+    def isMove(self, message):
+        return message[0] == MOVE
+
+    def executeAll(self, messages):
+        # drop stale frames first, so a stale move cannot hide a newer one
+        fresh = []
+        last = self.sequence
+        for message in messages:
+            if newer(message[4], last):
+                last = message[4]
+                fresh.append(message)
+        return super().executeAll(fresh)
+
+    def execute(self, message):
+        opcode, connectionId, x, y, sequence = message
+        if not newer(sequence, self.sequence):
+            return  # duplicate or out of order
+        self.sequence = sequence
+        if opcode == MOVE:
+            self.controller.move(self.connectionId, x, y)
+        elif opcode == PRESS:
+            self.controller.press(self.connectionId, x, y)
+        elif opcode == LIFT:
+            self.controller.lift(self.connectionId, x, y)
+        elif opcode == DOUBLE:
+            self.controller.double(self.connectionId, x, y)
+        elif opcode == CLOSE:
+            self.receiver.close()
+        return
+
+
+class SocketMessageReceiver(MessageReceiver):
+
+    def setup(self, setup):
+        self.socket = setup  # a connected socket or UdpPeer
+        self.frames = deque()  # decoded, waiting to be got
+        self.buffer = b""  # part of a frame
+        self.ended = False
+        self.reply = bytearray(FRAME.size)
+        self.sequence = 0
+        return
+
+    def read(self, flags=0):
+        # read what has arrived and decode the whole frames, False if nothing
+        if self.ended or not self.socket:
+            return False
+        try:
+            data = self.socket.recv(4096, flags)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b""
+        if not data:
+            self.ended = True
+            return False
+        if self.buffer:
+            data = self.buffer + data
+        usable = len(data) - len(data) % FRAME.size
+        self.frames.extend(FRAME.iter_unpack(memoryview(data)[:usable]))
+        self.buffer = data[usable:]
+        return True
+
+    def getMessage(self):
+        # the next frame as (opcode, connectionId, x, y, sequence), or None when closed
+        frames = self.frames
+        while not frames:
+            if not self.read():
+                return None
+        return frames.popleft()
+
+    def getMessages(self):
+        # all the frames that have arrived, waiting for some if none have
+        frames = self.frames
+        while not frames:
+            if not self.read():
+                return []
+        while self.read(socket.MSG_DONTWAIT):
+            pass
+        messages = list(frames)
+        frames.clear()
+        return messages
+
+    def send(self, opcode, connectionId, x=0.0, y=0.0):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        FRAME.pack_into(self.reply, 0, opcode, connectionId, x, y, self.sequence)
+        try:
+            self.socket.send(self.reply)
+        except OSError as e:
+            print("SocketMessageReceiver.send exception:", e)
+        return
+
+    def close(self):
+        connection = self.socket
+        if connection:
+            self.socket = None
+            if isinstance(connection, socket.socket):
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)  # wakes any recv
+                except OSError:
+                    pass
+            connection.close()
+        return
+
+
+class SocketClient():
+    '''
+    SocketClient(address, udp)
+    Drives a boat from a script by sending frames to a SocketServer at "address".
+
+    client.press(x, y), move(x, y), lift(x, y) and double(x, y) send one frame,
+    client.send(((opcode, x, y), ...)) sends a batch in one go.
+    client.waitForId() waits for the boat's HELLO and returns the connection id.
+    '''
+
+    def __init__(self, address=("localhost", 5005), udp=False):
+        if udp:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connectionId = 0
+        self.sequence = 0
+        self.frame = bytearray(FRAME.size)
+        return
+
+    def send(self, frames):
+        data = bytearray(FRAME.size * len(frames))
+        offset = 0
+        for opcode, x, y in frames:
+            self.sequence = (self.sequence + 1) & 0xFFFF
+            FRAME.pack_into(data, offset, opcode, self.connectionId, x, y, self.sequence)
+            offset += FRAME.size
+        self.socket.send(data)
+        return
+
+    def sendOne(self, opcode, x=0.0, y=0.0):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        FRAME.pack_into(self.frame, 0, opcode, self.connectionId, x, y, self.sequence)
+        self.socket.send(self.frame)
+        return
+
+    def press(self, x, y):
+        self.sendOne(PRESS, x, y)
+        return
+
+    def move(self, x, y):
+        self.sendOne(MOVE, x, y)
+        return
+
+    def lift(self, x, y):
+        self.sendOne(LIFT, x, y)
+        return
+
+    def double(self, x, y):
+        self.sendOne(DOUBLE, x, y)
+        return
+
+    def waitForId(self, timeout=None):
+        self.socket.settimeout(timeout)
+        data = self.socket.recv(FRAME.size)
+        self.socket.settimeout(None)
+        opcode, connectionId, x, y, sequence = FRAME.unpack(data)
+        if opcode == HELLO:
+            self.connectionId = connectionId
+        return self.connectionId
+
+    def close(self):
+        try:
+            self.sendOne(CLOSE)
+        except OSError:
+            pass
+        self.socket.close()
+        return
+
+
+if __name__ == '__main__':
+    # drive a counting boat over loopback with TCP and UDP
+    from time import sleep, perf_counter
+
+    from CommsController import CommsController, CountingBoat
+
+    boat = CountingBoat()
+    tcp = SocketServer(("localhost", 0))
+    udp = SocketServer(("localhost", 0), udp=True)
+    controller = CommsController(server=tcp, boat=boat)
+    controller.addServer(udp)
+
+    for server, isUdp in ((tcp, False), (udp, True)):
+        client = SocketClient(server.receiver.address, udp=isUdp)
+        if isUdp:
+            client.press(0, 0)  # UDP connects on the first frame
+        print("UDP" if isUdp else "TCP", "connection id:", client.waitForId(1))
+        count = 10000
+        before = boat.navigated
+        start = perf_counter()
+        client.press(0, 0.1)
+        for i in range(0, count, 100):  # batches of 100 moves
+            client.send([(MOVE, 0, (i + j) / count) for j in range(100)])
+        client.lift(0, 1)
+        taken = perf_counter() - start
+        sleep(0.5)
+        print("sent", count + 2, "frames in %.3f s," % taken,
+              "boat navigated", boat.navigated - before, "times, ending at", (boat.x, boat.y))
+        client.close()
+        sleep(0.2)
+    print("dispatcher: posted", controller.dispatcher.posted,
+          "delivered", controller.dispatcher.delivered)
+    controller.shutdown()
@@ -1,12 +1,93 @@
 #!/usr/bin/env python
 # Turret.py - implemnet moving the turrets as steppers on the MCP23017 I2C Port Expander
 
-from threading import Thread
-from queue import Queue, Empty
-from smbus import SMBus
-from time import sleep
+from threading import Thread, Condition, RLock
+from array import array
+from heapq import heappush, heappop
+from math import ceil, sqrt
+from time import sleep, monotonic
+
+try:
+    from smbus import SMBus
+except ImportError:  # not on a Pi, so setBusFactory() needs to be used
+    SMBus = None
 
 mcp = [None, None]  # singletons
+buses = {}  # I2CBus singletons by bus number
+busFactory = [SMBus]  # makes the SMBus like object for a bus number
+
+
+def setBusFactory(factory):
+    '''
+    Use factory(number) to make the buses from now on.
+
+    For example FakeSMBus, to run the turrets off the Pi.
+    '''
+    busFactory[0] = factory
+    return
+
+
+def sharedBus(number=1):
+    '''
+    The I2CBus for number, shared by every expander on it.
+    '''
+    if number not in buses:
+        buses[number] = I2CBus(number)
+    return buses[number]
+
+
+def resetAll(turrets):
+    '''
+    Reset all the turrets together, without waiting for them.
+
+    The engines are held off while the sweeps are queued so that every
+    turret starts on the same step, and turrets on the same expander
+    share each write for the whole of the sweep.
+    '''
+    engines = []
+    for turret in turrets:
+        if turret.expander.idle not in engines:
+            engines.append(turret.expander.idle)
+    for idle in engines:
+        idle.acquire()
+    try:
+        for turret in turrets:
+            turret.reset()
+    finally:
+        for idle in engines:
+            idle.release()
+    return
+
+
+def planMove(steps, rate, startRate, maxRate, accel):
+    '''
+    Plan a trapezoidal move of steps, returning the interval before each step.
+
+    Accelerate from rate (or startRate if slower) by accel up to maxRate,
+    cruise and then decelerate so the last step is back at startRate.
+    Rates are steps/second and accel is steps/second/second,
+    with accel of 0 giving a constant startRate.
+    If the move is too short to reach maxRate the cruise is skipped.
+    '''
+    intervals = array('d', bytes(8 * steps))
+    start2 = max(rate, startRate) ** 2
+    stop2 = startRate * startRate
+    for i in range(steps):
+        speed = min(sqrt(start2 + 2 * accel * i),
+                    sqrt(stop2 + 2 * accel * (steps - 1 - i)),
+                    maxRate)
+        intervals[i] = 1.0 / max(speed, startRate)
+    return intervals
+
+
+def planPhases(phases, start, steps, step):
+    '''
+    Compile the phase for each step of a move from start as bytes.
+
+    So the engine just streams them out rather than working them out per step.
+    '''
+    count = len(phases)
+    return bytes(phases[(start + step * i) % count] for i in range(1, steps + 1))
 
 
 class Turret():
@@ -21,14 +102,31 @@ class Turret():
        A = 0 for default expander, and 1 second (assuming A0,A1,A2 set to 1, 0, 0)
        B = 0 for port A pins and 1 for port B
        C = 0 for 1st 4 (0-3) pins and 1 for 2nd (4-7) pins
-    Also need to define whether we are using whole or half phase cycles.
-    Also need to define how quick we will turn.
-    Both these may be defined at a lower level.
+    Also need to define whether we are using whole or half phase cycles,
+    the optional mode is one of:
+       "wave" - one coil at a time (the default),
+       "full" - two coils at a time for more torque,
+       "half" - alternating one and two coils, giving twice the positions
+          (so size is still in whole steps but positions are half steps).
+    How quick we turn is set by the optional acceleration profile:
+       startRate - steps/second the stepper can start and stop at,
+       maxRate - fastest steps/second to cruise at,
+       accel - steps/second/second to speed up and slow down by.
+    Each move is planned to ramp up from startRate to maxRate and back down.
 
     Posible methods:
        turret.set(x) will move the turret to position x,
           where 0 <= x <= size, or size <= x <= -size.
           Moves outside of the range will be OutOfRangeErrors.
+          The move is handed to the expander's motion engine and
+          set() returns straight away, so it is safe to call from
+          the BlueDot callback thread.
+          A new set() replaces any target not yet reached,
+          so dragging only steps to the latest position.
+       turret.step is the step the turret has actually reached.
+       turret.moving is True while the turret still has steps to make.
+       turret.wait() will block until the turret has stopped moving
+          (or the optional timeout expires) for callers that need it.
        turret.reset() will effectively try to reset the turret
           by moving too far below 0,
           back to full sweep
@@ -43,6 +141,13 @@ class Turret():
              turret.set(-size),
              turret.set(0)
              This assumes a hard stop below size'th position and above -size'th position.
+          reset() returns straight away and turret.homing is True until done.
+          With a journal (see TurretJournal) the turret starts where it
+          was last left, and reset() skips or shortens the sweeps.
+          With an end stop switch (endstop is the pin number 0 to 15
+          on the same expander, activeLow if it pulls the pin down)
+          reset() sweeps down only until it trips, and then to 0.
+          resetAll(turrets) resets a whole set of turrets at once.
 
     Internally, each turret will share one of 2 (or 4) MCP23017 objects
     for each expander (and possibly port) that will actually send
@@ -56,29 +161,50 @@ class Turret():
     IODIRB = 0x01  # Pin direction register
     OLATA = 0x14  # Register for outputs
     OLATB = 0x15  # Register for outputs
-    PHASES = (0b0001,
-              0b0011,
-              0b0010,
-              0b0110,
-              0b0100,
-              0b1100,
-              0b1000,
-              0b1001
-              )
-
-    PHASES = (0b0001,
-              0b0010,
-              0b0100,
-              0b1000
-              )
-
-    def __init__(self, size, address=(0, 0, 0)):
+    # phase tables for each drive mode
+    WAVE = (0b0001,  # one coil at a time
+            0b0010,
+            0b0100,
+            0b1000
+            )
+    FULL = (0b0011,  # two coils at a time - more torque
+            0b0110,
+            0b1100,
+            0b1001
+            )
+    HALF = (0b0001,  # alternate one and two coils - half steps
+            0b0011,
+            0b0010,
+            0b0110,
+            0b0100,
+            0b1100,
+            0b1000,
+            0b1001
+            )
+    DRIVES = {"wave": WAVE, "full": FULL, "half": HALF}
+    PHASES = WAVE  # default drive
+
+    START_RATE = 20.0  # steps/second - the old fixed 50 ms a step
+    MAX_RATE = 100.0  # steps/second
+    ACCEL = 400.0  # steps/second/second
+
+    def __init__(self, size, address=(0, 0, 0), startRate=START_RATE, maxRate=MAX_RATE, accel=ACCEL, mode="wave",
+                 journal=None, endstop=None, activeLow=True):
         expander, port, nibble = address
         if not mcp[expander]:
             mcp[expander] = MCP23017(expander)
         self.expander = mcp[expander]
         # port number is 0 to 3 based on address port (A or B) and nibbler (lsn or msn)
-        self.port = port  # * 2 + nibble
+        self.port = port * 2 + nibble
+
+        # drive mode - half steps double the number of positions (and rates)
+        self.mode = mode
+        self.phases = self.DRIVES[mode]
+        self.scale = len(self.phases) // 4
+        size *= self.scale
+        self.expander.setDrive(self.port, self.phases)
+        self.expander.setProfile(self.port, startRate * self.scale,
+                                 maxRate * self.scale, accel * self.scale)
 
         # set up range
         self.min = 0
@@ -89,6 +215,20 @@ class Turret():
         self.position = 0
         self.mid = 0  # always 0 is default position
         self.range = (self.max - self.min + 1, self.min, self.max, self.mid)
+
+        # optional end stop switch on a spare pin of the expander
+        self.endstop = endstop
+        if endstop is not None:
+            self.expander.setEndstop(self.port, endstop, activeLow)
+
+        # pick up where we were last time from any journal
+        self.restored = None
+        if journal:
+            saved = self.expander.setJournal(self.port, journal, expander * 4 + self.port,
+                                             self.min, self.max)
+            if saved:
+                self.restored = saved
+                self.position = saved[0]
         return
 
     def requestStop(self):
@@ -106,23 +246,76 @@ class Turret():
         self.expander.waitForStop()
         return
 
+    @property
+    def step(self):
+        '''
+        The step the Turret has actually reached (position is where it is going).
+        '''
+        return self.expander.position(self.port)
+
+    @property
+    def moving(self):
+        '''
+        True while the motion engine still has steps to make for this Turret.
+        '''
+        return self.expander.isMoving(self.port)
+
+    def wait(self, timeout=None):
+        '''
+        Wait for the Turret to finish moving.
+
+        Returns False if timeout (seconds) expired before it stopped.
+        '''
+        return self.expander.waitForPort(self.port, timeout)
+
     def set(self, pos):
         '''
         Set Turret to pos.
+
+        Replaces any earlier target not yet reached.
+        Returns as soon as the move is queued, use wait() to block.
         '''
         if pos < self.min:
             raise ValueError("Less than minimum value")
         if pos > self.max:
             raise ValueError("Greater than maximum value")
         print("Turret moving from", self.position, "to", pos)
-        self.expander.addCycles(self.port, self.position, pos)
+        self.expander.moveTo(self.port, pos)
         self.position = pos
         return
 
-    def reset(self):
+    @property
+    def homing(self):
+        '''
+        True while the Turret is still sweeping from a reset().
+        '''
+        return self.expander.isHoming(self.port)
+
+    def reset(self, full=False):
         '''
         Reset Turret to 0 after swiping through min and max.
+
+        Returns straight away, the sweeps are done by the motion engine
+        and any set() while homing is done once it has finished.
+        If the journal showed a clean stop it just goes to 0,
+        and if it stopped part way through a move it only sweeps
+        down from as far as it could have got, unless full is True.
         '''
+        saved = self.restored
+        self.restored = None  # only good until the first reset
+        start = self.max
+        if saved and not full:
+            step, target, clean = saved
+            if clean:
+                self.set(0)
+                return
+            start = min(max(step, target) + 1, self.max)
+        if self.endstop is not None or start != self.max:
+            # down until the end stop trips (or we have gone far enough), then to 0
+            self.expander.addCycles(self.port, start, self.min, seek=self.endstop is not None)
+            self.expander.addCycles(self.port, self.min, 0)
+            self.position = 0
+            return
         self.expander.addCycles(self.port, self.max, self.min)
         self.expander.addCycles(self.port, self.min, self.max)
         self.expander.addCycles(self.port, self.max, 0)
@@ -157,8 +350,12 @@ class MCP23017:
     '''
     The "address" of MCP23017 is expander where
        expander = 0 for default expander, and 1 second (assuming A0,A1,A2 set to 1, 0, 0)
-    Each MCP23017 expander can handle 4 steppers, so have a queue for each.
-    Combine the data from all 4 queues into a single word for each cycle.
+    Each MCP23017 expander can handle 4 steppers, one on each nibble,
+    numbered 0 to 3 as port A lsn, port A msn, port B lsn and port B msn.
+    Combine the phases of all 4 into a single word for each cycle,
+    so each cycle is one block write (OLATA then OLATB) however many move.
+    The stepping itself is done by the I2CBus the expander is on
+    (by default the shared bus 1), along with all the other expanders on it.
     '''
 
     # class fields
@@ -166,156 +363,555 @@ class MCP23017:
     IOCON = 0x0A  # Configuration register - set to 0x02 so no interrupts and sequential ports
     IODIRA = 0x00  # Pin direction register
     IODIRB = 0x01  # Pin direction register or second byte of pin direction word
+    GPINTENA = 0x04  # Interrupt on change enable (B is the next register for all these)
+    DEFVALA = 0x06  # Default value to compare with for interrupts
+    INTCONA = 0x08  # Interrupt on difference from DEFVAL rather than on change
+    GPPUA = 0x0C  # Pull up resistors
+    INTFA = 0x0E  # Interrupt flags - which pins have interrupted
+    INTCAPA = 0x10  # Pins at time of interrupt
+    GPIOA = 0x12  # Register for inputs
     OLATA = 0x14  # Register for outputs
     OLATB = 0x15  # Register for outputs or second byte of pin output word
 
-    PHASES = (0b0001,
-              0b0010,
-              0b0100,
-              0b1000
-              )
-
-    def __init__(self, address=0):
+    def __init__(self, address=0, bus=None):
         self.device = address + self.DEVICE
-        self.bus = SMBus(1)
+        if not bus:
+            bus = sharedBus()
+        self.bus = bus
+        # shadow of the registers we have written, None until written
+        self.shadow = [None] * (self.OLATB + 1)
         # Update configuration register
-        self.bus.write_byte_data(self.device, self.IOCON, 0x02)
+        self.writeRegisters(self.IOCON, (0x02,))
         # make all pins of both ports output
-        self.bus.write_word_data(self.device, self.IODIRA, 0)
+        self.writeRegisters(self.IODIRA, (0, 0))
+
+        # default profile: start (and stop) at the old fixed 50 ms a step
+        self.profiles = [(20.0, 20.0, 0.0)] * 4  # (startRate, maxRate, accel)
+
+        # motion engine: each port has a current step, a list of sweeps
+        # (from addCycles) to work through in order and then a single
+        # target slot (from moveTo) where the latest target always wins
+        self.current = [0, 0, 0, 0]  # real step each port is at
+        self.sweeps = ([], [], [], [])  # (start, stop) legs still to do
+        self.targets = [None, None, None, None]  # latest target requested
+        self.active = [False, False, False, False]  # coils energised?
+        self.drives = [Turret.WAVE] * 4  # phase table for each port
+        self.owned = [False, False, False, False]  # port driven by a turret?
+        self.plans = [None, None, None, None]  # [goal, intervals, phases, index, step] being run
+        self.outputs = [0, 0, 0, 0]  # phase currently on each port
+        self.rates = [0.0, 0.0, 0.0, 0.0]  # current speed (steps/second)
+        self.due = [0.0, 0.0, 0.0, 0.0]  # when each port next needs attention
+        self.scheduled = [False, False, False, False]  # port on the bus schedule?
+        self.journals = [None, None, None, None]  # TurretJournal for each port
+        self.slots = [None, None, None, None]  # slot in the journal
+        self.unflushed = []  # journals to flush before the next write
+        self.trusted = [False, False, False, False]  # homed, so current is right
+        self.endstops = [None, None, None, None]  # (pin, activeLow) of any end stop switch
+        self.inputs = None  # (INTF, GPIO) words last read while seeking
+        self.idle = self.bus.idle  # guards the above, notified on any change
+        self.stopping = False
+        self.index = self.bus.add(self)  # the bus does the stepping
+        return
+
+    def word(self):
+        '''
+        The phases of all 4 ports or'ed together for OLATA (lsb) and OLATB (msb).
+        '''
+        outputs = self.outputs
+        return outputs[0] | outputs[1] << 4 | outputs[2] << 8 | outputs[3] << 12
+
+    def writeRegisters(self, register, values):
+        '''
+        Write values to sequential registers from register, skipping what they already hold.
+
+        Only the span from the first to the last changed byte is sent,
+        as a single byte write or a block write.
+        Returns the number of bytes sent.
+        '''
+        shadow = self.shadow
+        with self.bus.lock:
+            first = last = None
+            for i in range(len(values)):
+                if shadow[register + i] != values[i]:
+                    if first is None:
+                        first = i
+                    last = i
+            if first is None:
+                return 0  # nothing changed
+            if first == last:
+                self.bus.writeByte(self.device, register + first, values[first])
+            else:
+                self.bus.writeBlock(self.device, register + first, values[first:last + 1])
+            for i in range(first, last + 1):
+                shadow[register + i] = values[i]
+        return last + 1 - first
+
+    def updateRegister(self, register, mask, value):
+        '''
+        Read-modify-write of the bits in mask of register, done on the shadow.
+        '''
+        with self.bus.lock:
+            old = self.shadow[register] or 0
+            self.writeRegisters(register, ((old & ~mask) | (value & mask),))
+        return
+
+    def writeOutputs(self, word):
+        '''
+        Set OLATA (lsb) and OLATB (msb) to word, only writing what changed.
+        '''
+        return self.writeRegisters(self.OLATA, (word & 0xFF, word >> 8))
+
+    def advance(self, port, now):
+        '''
+        Make the next step for port, if it has anywhere to go, or switch it off.
+
+        Returns True if it stepped, so the outputs must be written now,
+        while switching off can wait for the next write.
+        Must be called holding self.idle.
+        '''
+        goal = self.goal(port)
+        if goal is None:
+            if self.active[port]:
+                self.active[port] = False
+                self.outputs[port] = 0  # switch off all coils
+                self.plans[port] = None
+                self.rates[port] = 0.0
+                journal = self.journals[port]
+                if journal:  # commit the stop
+                    step = self.current[port]
+                    journal.record(self.slots[port], step, step, self.trusted[port])
+                    self.unflushed.append(journal)
+            self.idle.notify_all()  # this port has stopped
+            return False
+        plan = self.plans[port]
+        planned = False
+        if plan is None or plan[0] != goal or plan[3] == len(plan[1]):
+            # (re)plan from where we are, keeping our speed if still going the same way
+            current = self.current[port]
+            startRate, maxRate, accel = self.profiles[port]
+            heading = 0  # the way we are already going, if at all
+            rate = 0.0
+            brake = 0  # steps needed to slow to startRate
+            if plan is not None:
+                heading = plan[4]
+                rate = self.rates[port]
+                if accel > 0 and rate > startRate:
+                    brake = ceil((rate * rate - startRate * startRate) / (2 * accel))
+                    # the old plan slows to startRate by its end, so never beyond that
+                    brake = min(brake, len(plan[1]) - plan[3])
+            if brake and (goal - current) * heading < brake:
+                # goal is behind us or too close to stop for, so slow down first,
+                # overshooting, and head for the goal once this runs out
+                steps = brake
+                step = heading
+            else:
+                steps = abs(goal - current)
+                step = 1
+                if goal < current:
+                    step = -1
+                if step != heading:
+                    rate = 0.0
+            plan = [goal,
+                    planMove(steps, rate, startRate, maxRate, accel),
+                    planPhases(self.drives[port], current, steps, step),
+                    0,
+                    step]
+            self.plans[port] = plan
+            planned = True
+        step = plan[4]
+        index = plan[3]
+        interval = plan[1][index]
+        self.outputs[port] = plan[2][index]
+        plan[3] = index + 1
+        self.current[port] += step
+        self.rates[port] = 1.0 / interval
+        due = self.due[port] + interval
+        if not self.active[port] or due < now:  # starting, or fallen behind
+            due = now + interval
+        self.due[port] = due
+        self.active[port] = True
+        journal = self.journals[port]
+        if journal:
+            # record where this plan ends (past the goal if braking), and get each
+            # new plan on disk before its first step, so a crash part way is seen
+            end = self.current[port] + (len(plan[1]) - plan[3]) * step
+            journal.record(self.slots[port], self.current[port], end)
+            if planned:
+                self.unflushed.append(journal)
+        return True
+
+    def goal(self, port):
+        '''
+        Work out where port should be heading next, or None if it is there.
+
+        Must be called holding self.idle.
+        '''
+        sweeps = self.sweeps[port]
+        while sweeps:
+            start, stop, seek = sweeps[0]
+            if start is not None:  # starting this leg
+                self.current[port] = start
+                self.plans[port] = None
+                sweeps[0] = (None, stop, seek)
+            elif seek and self.tripped(port):
+                self.current[port] = stop  # found the end stop, so we are there
+                self.plans[port] = None
+            if stop != self.current[port]:
+                return stop
+            sweeps.pop(0)  # done this leg
+            if not sweeps:
+                self.trusted[port] = True  # homed
+        target = self.targets[port]
+        if target is not None:
+            if target != self.current[port]:
+                return target
+            plan = self.plans[port]
+            if (plan is not None and plan[3] < len(plan[1])
+                    and self.rates[port] > self.profiles[port][0]):
+                return target  # too fast to stop here, so slow down and come back
+        self.targets[port] = None
+        return None
+
+    def setJournal(self, port, journal, slot, low, high):
+        '''
+        Record the steps of port in slot of journal.
+
+        Returns the (step, target, clean) saved last time if it is
+        between low and high, in which case port starts from that step.
+        '''
+        saved = journal.restore(slot)
+        with self.idle:
+            self.journals[port] = journal
+            self.slots[port] = slot
+            if saved and low <= saved[0] <= high and low <= saved[1] <= high:
+                self.current[port] = saved[0]
+                self.trusted[port] = saved[2]
+            else:
+                saved = None
+        return saved
+
+    def setDrive(self, port, phases):
+        '''
+        Set the phase table used to step port, which is then owned by its turret.
+        '''
+        with self.idle:
+            for endstop in self.endstops:
+                if endstop and endstop[0] // 4 == port:
+                    raise ValueError("Port's stepper pins are used by an end stop")
+            self.drives[port] = phases
+            self.owned[port] = True
+            self.plans[port] = None
+        return
+
+    def setPeriod(self, port, period):
+        '''
+        Step port at a fixed period (seconds) with no acceleration.
+        '''
+        self.setProfile(port, 1.0 / period, 1.0 / period, 0.0)
+        return
 
-        self.period = 0.05  # length of a cycle = 5 milliseconds - 4 may be possible
+    def setProfile(self, port, startRate, maxRate, accel):
+        '''
+        Set the acceleration profile (in steps/second and steps/second/second) for port.
+
+        startRate is the speed the stepper can start and stop at without losing steps.
+        '''
+        with self.idle:
+            self.profiles[port] = (startRate, max(startRate, maxRate), accel)
         return
 
     def requestStop(self):
         self.stopping = True
+        self.bus.requestStop()
         return
 
     def waitForStop(self):
+        self.bus.waitForStop()
+        return
+
+    def isHoming(self, port):
+        return len(self.sweeps[port]) > 0
+
+    def isSeeking(self, port):
+        '''
+        True if port is on a sweep that stops at its end stop.
+        '''
+        sweeps = self.sweeps[port]
+        return len(sweeps) > 0 and sweeps[0][2]
+
+    def tripped(self, port):
+        '''
+        Has the end stop for port been hit, going by the last inputs read?
+
+        Either it is active now or it has interrupted since the last read.
+        '''
+        if not self.inputs or not self.endstops[port]:
+            return False
+        pin, activeLow = self.endstops[port]
+        flags, levels = self.inputs
+        mask = 1 << pin
+        if flags & mask:
+            return True
+        if activeLow:
+            return not levels & mask
+        return levels & mask != 0
+
+    def readInputs(self):
+        '''
+        Read the interrupt flags, captures and inputs (reading clears the interrupt).
+
+        Returns (INTF, GPIO) as words, port A in the lsb.
+        '''
+        values = self.bus.readBlock(self.device, self.INTFA, 6)
+        flags = values[0] | values[1] << 8
+        levels = values[4] | values[5] << 8
+        return (flags, levels)
+
+    def setEndstop(self, port, pin, activeLow=True):
+        '''
+        Use pin (0 to 15, port B is 8 up) as an end stop switch at the low end for port.
+
+        The pin is made an input (with pull up if activeLow) and set to
+        interrupt whenever it is not at its inactive level, so even
+        a brief trip between reads is latched in INTF.
+        '''
+        if not 0 <= pin < 16:
+            raise ValueError("End stop pin must be from 0 to 15")
+        if pin // 4 == port:
+            raise ValueError("End stop pin is one of the port's own stepper pins")
+        if self.owned[pin // 4]:
+            raise ValueError("End stop pin is one of another turret's stepper pins")
+        bank = pin // 8  # A or B register
+        bit = 1 << (pin % 8)
+        inactive = 0
+        if activeLow:
+            inactive = bit
+        with self.bus.lock:
+            self.updateRegister(self.IODIRA + bank, bit, bit)  # input
+            self.updateRegister(self.GPPUA + bank, bit, inactive)  # pull up
+            self.updateRegister(self.DEFVALA + bank, bit, inactive)
+            self.updateRegister(self.INTCONA + bank, bit, bit)  # compare with DEFVAL
+            self.updateRegister(self.GPINTENA + bank, bit, bit)
+        with self.idle:
+            self.endstops[port] = (pin, activeLow)
         return
 
-    def addCycles(self, port, start, stop):
+    def isMoving(self, port):
+        return (self.active[port] or len(self.sweeps[port]) > 0
+                or self.targets[port] is not None)
+
+    def waitForPort(self, port, timeout=None):
+        '''
+        Wait until port has finished moving.
+        '''
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.isMoving(port), timeout)
+
+    def position(self, port):
+        '''
+        The step port has actually reached.
+        '''
+        return self.current[port]
+
+    def moveTo(self, port, target):
+        '''
+        Set the target for port, replacing any target not yet reached.
+
+        The engine heads for it from wherever port actually is,
+        once any sweeps have been done.
+        Returns immediately, the motion engine does the stepping.
+        '''
+        with self.idle:
+            self.targets[port] = target
+            self.wake(port)
+        return
+
+    def addCycles(self, port, start, stop, seek=False):
         '''
         Add the cycles to move from start to stop for port.
-        Request the cycles for the relevant port
+        Queue the cycles for the relevant port
         starting from the start position up to and inclucing the stop position.
+        Unlike moveTo() these are never replaced, so are used for sweeps,
+        and any pending target is dropped.
+        If seek is True the sweep ends as soon as the port's end stop trips,
+        and the port is then taken to be at stop.
+        Returns immediately, the motion engine does the stepping.
         '''
         print("addCycles(", port, ",", start, ",", stop, ")")
-        step = 1
-        if start > stop:
-            step = -1  # reverse the directrion
-        for index in range(start, stop, step):
-            phase = index % len(self.PHASES)
-            word = self.PHASES[phase]
-            word *= 257  # duplicate to msb nibble
-            self.bus.write_byte_data(self.device, self.OLATA + port, word)
-            sleep(self.period)  # give steppers chance to react
-        phase = stop % len(self.PHASES)
-        word = self.PHASES[phase]
-        word *= 257  # duplicate to msb nibble
-        self.bus.write_byte_data(self.device, self.OLATA + port, word)
-        sleep(self.period)  # give steppers chance to react
-        # switch off all coils
-        self.bus.write_byte_data(self.device, self.OLATA + port, 0)
+        with self.idle:
+            self.sweeps[port].append((start, stop, seek))
+            self.targets[port] = None
+            self.trusted[port] = False  # until the sweeps are done
+            self.wake(port)
         return
 
+    def wake(self, port):
+        '''
+        Make sure port is on the schedule, so the engine looks at it now.
 
-class ThreadedMCP23017:
-    '''
-    The "address" of MCP23017 is expander where
-       expander = 0 for default expander, and 1 second (assuming A0,A1,A2 set to 1, 0, 0)
-    Each MCP23017 expander can handle 4 steppers, so have a queue for each.
-    Combine the data from all 4 queues into a single word for each cycle.
-    '''
+        Must be called holding self.idle.
+        '''
+        if not self.scheduled[port]:
+            self.scheduled[port] = True
+            heappush(self.bus.schedule, (monotonic(), self.index, port))
+        self.idle.notify_all()
+        return
 
-    # class fields
-    DEVICE = 0x20  # Base device address (A0-A2)
-    IOCON = 0x0A  # Configuration register - set to 0x02 so no interrupts and sequential ports
-    IODIRA = 0x00  # Pin direction register
-    IODIRB = 0x01  # Pin direction register or second byte of pin direction word
-    OLATA = 0x14  # Register for outputs
-    OLATB = 0x15  # Register for outputs or second byte of pin output word
 
-    PHASES = (0b0001,
-              0b0010,
-              0b0100,
-              0b1000
-              )
+# the merged word scheduler is now the only one
+ThreadedMCP23017 = MCP23017
 
-    def __init__(self, address=0):
-        self.device = address + self.DEVICE
-        self.bus = SMBus(1)
-        # Update configuration register
-        self.bus.write_byte_data(self.device, self.IOCON, 0x02)
-        # make all pins of both ports output
-        self.bus.write_word_data(self.device, self.IODIRA, 0)
-
-        self.queues = (Queue(),
-                       Queue(),
-                       Queue(),
-                       Queue()
-                       )
-        self.period = 0.05  # length of a cycle = 5 milliseconds - 4 may be possible
-        self.thread = Thread(group=None, target=self.sendCycles)
+
+class I2CBus:
+    '''
+    Owner of one I2C bus (1 on rev 2 Pi's) and everything sent on it.
+
+    All the MCP23017 expanders on the bus share it, so there is one
+    thread and one timeline of steps for all of them rather than
+    a thread per expander racing for the bus.
+    The schedule is a heap of (due, expander index, port) for every port
+    with something to do, and each time round every expander that has
+    changed gets its output word written in one transaction.
+    The expanders keep a shadow of their registers so unchanged bytes are never sent.
+    Every transaction goes through the lock so none can be torn.
+    The smbus used can be given (e.g. a FakeSMBus), otherwise it is made
+    by the bus factory (normally smbus.SMBus).
+    '''
+
+    def __init__(self, number=1, smbus=None):
+        if not smbus:
+            if not busFactory[0]:
+                raise ImportError("No smbus module, use setBusFactory() to provide one")
+            smbus = busFactory[0](number)
+        self.smbus = smbus
+        self.lock = RLock()  # one transaction (or shadow update) at a time
+        self.transactions = 0  # count of transactions sent
+        self.idle = Condition()  # guards all the expanders' stepping state
+        self.expanders = []
+        self.schedule = []  # heap of (due, expander index, port)
+        self.slack = 0.001  # steps due this close together go in the same write
+        self.stopping = False
+        self.thread = Thread(group=None, target=self.runMoves, daemon=True)
         self.thread.start()
         return
 
-    def sendCycles(self):
-        self.running = True
-        self.stopping = False
-        self.last = 0
-        while self.running:
-            readSomething = False
-            word = 0
-            for port in range(len(self.queues)):
-                phase = 0
-                try:
-                    phase = self.queues[port].get_nowait()
-                    readSomething = True
-                except Empty as e:
-                    # queue is empty
-                    phase = 0
-                # shift for relevant nibble / port
-                shifted = phase << (port * 4)
-                word |= shifted    # or together
-                # print("port", port, "phase", phase, "shifted", shifted, "word", word)
-            if readSomething:
-                # print("{0:b}".format(word))
-                self.bus.write_word_data(self.device, self.OLATA, word)
-                self.last = word
-            else:  # nothing to send
-                if self.last != 0:
-                    # ensure we do not leave stepper active
-                    self.bus.write_word_data(
-                        self.device, self.OLATA, 0)  # set all to off
-                    self.last = 0
-                else:
-                    if self.stopping:  # requested to shut down and nothing active
-                        self.running = False
-            sleep(self.period)  # give steppers chance to react
+    def add(self, expander):
+        '''
+        Add an expander to the bus, returns its index for the schedule.
+        '''
+        with self.idle:
+            self.expanders.append(expander)
+            return len(self.expanders) - 1
+
+    def writeByte(self, device, register, value):
+        with self.lock:
+            self.smbus.write_byte_data(device, register, value)
+            self.transactions += 1
         return
 
-    def requestStop(self):
-        self.stopping = True
+    def readBlock(self, device, register, length):
+        '''
+        Read length sequential registers from register in one transaction.
+        '''
+        with self.lock:
+            values = self.smbus.read_i2c_block_data(device, register, length)
+            self.transactions += 1
+        return values
+
+    def writeBlock(self, device, register, values):
+        '''
+        Write values to sequential registers from register in one transaction.
+        '''
+        with self.lock:
+            self.smbus.write_i2c_block_data(device, register, list(values))
+            self.transactions += 1
         return
 
-    def waitForStop(self):
-        self.thread.join()  # and wait for thread to stop
+    def runMoves(self):
+        '''
+        Motion engine - step each port when its step is due.
+
+        Each port runs its own acceleration profile, so has its own deadline,
+        kept in the self.schedule heap only while the port has something to do.
+        The phases for all 4 ports of an expander are or'ed into one word
+        and written in one go, only the bytes of OLATA / OLATB that changed.
+        Ports that have arrived are switched off (nibble left as 0) one step later.
+        Each port is stepped at most once a pass, so no phase is skipped on the wire,
+        and any journal records to be committed are flushed before the write,
+        with the bus state unlocked.
+        Sleeps until the next deadline, or until woken by a new move when
+        nothing is scheduled, and stops once requested and everything has finished.
+        '''
+        schedule = self.schedule
+        expanders = self.expanders
+        self.idle.acquire()
+        while True:
+            now = monotonic()
+            changed = []
+            stepped = []  # ports done this pass, back on the schedule after the write
+            flushes = []
+            while schedule and schedule[0][0] <= now + self.slack:
+                index, port = heappop(schedule)[1:]
+                expander = expanders[index]
+                if expander.isSeeking(port):  # look at the end stop before stepping
+                    self.idle.release()
+                    try:
+                        inputs = expander.readInputs()
+                    except Exception as e:
+                        print("I2CBus read exception:", e)
+                        inputs = None
+                    self.idle.acquire()
+                    expander.inputs = inputs
+                moved = expander.advance(port, now)
+                if expander.active[port]:
+                    stepped.append((expander.due[port], index, port))
+                else:
+                    expander.scheduled[port] = False
+                for journal in expander.unflushed:
+                    if journal not in flushes:
+                        flushes.append(journal)
+                expander.unflushed.clear()
+                # switching a port off rides along with the next step of
+                # another port, unless it was the last one moving
+                if moved or True not in expander.active:
+                    if expander not in changed:
+                        changed.append(expander)
+            if changed or flushes:
+                writes = [(expander, expander.word()) for expander in changed]
+                self.idle.release()
+                for journal in flushes:
+                    try:
+                        journal.flush()
+                    except Exception as e:
+                        print("I2CBus journal exception:", e)
+                for expander, word in writes:
+                    try:
+                        expander.writeOutputs(word)  # only what changed
+                    except Exception as e:
+                        print("I2CBus move exception:", e)
+                self.idle.acquire()
+            for entry in stepped:
+                heappush(schedule, entry)
+            if schedule:
+                self.idle.wait(schedule[0][0] - monotonic())
+            elif self.stopping:
+                break
+            else:  # nothing moving
+                self.idle.wait()
+        self.idle.release()
         return
 
-    def addCycles(self, port, start, stop):
+    def requestStop(self):
         '''
-        Add the cycles to move from start to stop for port.
-        Add the cycles to the queue forthe relevant port
-        starting from the start position up to and inclucing the stop position.
+        Stop once every expander on the bus has asked and all moves are done.
         '''
-        print("addCycles(", port, ",", start, ",", stop, ")")
-        step = 1
-        if start > stop:
-            step = -1  # reverse the directrion
-        for index in range(start, stop, step):
-            phase = index % len(self.PHASES)
-            self.queues[port].put_nowait(self.PHASES[phase])
-        self.queues[port].put_nowait(self.PHASES[stop % len(self.PHASES)])
+        with self.idle:
+            self.stopping = all(expander.stopping for expander in self.expanders)
+            self.idle.notify_all()
+        return
+
+    def waitForStop(self):
+        self.thread.join()  # and wait for the engine to finish
         return
 
 
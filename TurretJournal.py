@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# TurretJournal.py - remember where the turrets are between runs
+"""
+TurretJournal is a small crash-safe journal of turret positions.
+
+It is a fixed size file mapped into memory (mmap), with a slot for each
+turret (expander * 4 + port) holding the last step it committed,
+where it was heading and whether it was stopped cleanly.
+Each slot has two copies written alternately, each with a sequence
+number and a crc, so a write torn by a crash leaves the other copy good.
+At start up a clean record means the turret is where it says it is
+and homing can be skipped, and even an unclean one limits how far
+the homing sweep needs to go.
+"""
+
+import mmap
+import os
+import struct
+import zlib
+
+
+class TurretJournal():
+    '''
+    TurretJournal(path, slots)
+    Where "path" is the journal file, created if needed,
+    and "slots" is how many turrets it can hold (default 8 - 2 expanders).
+
+    journal.restore(slot) gives (step, target, clean) saved for slot, or None.
+    journal.record(slot, step, target, clean) saves the state of slot.
+    journal.flush() makes sure the records are on disk.
+    '''
+
+    MAGIC = b"TJNL"
+    VERSION = 1
+    SLOTS = 8  # 2 expanders of 4 ports
+    HEADER = struct.Struct("<4sI")  # magic, version
+    BODY = struct.Struct("<IiiB3x")  # sequence, step, target, flags
+    CRC = struct.Struct("<I")
+    RECORD = BODY.size + CRC.size
+    CLEAN = 0x01  # stopped, and position known to be right
+
+    def __init__(self, path, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        size = self.HEADER.size + slots * 2 * self.RECORD
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size
+            if fresh:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)  # the map keeps its own reference
+        if fresh or self.HEADER.unpack_from(self.map, 0) != (self.MAGIC, self.VERSION):
+            self.map[:] = bytes(size)
+            self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION)
+            self.map.flush()
+        self.sequences = [0] * slots  # sequence of the newest copy
+        self.newest = [0] * slots  # which copy is newest
+        self.saved = [self.load(slot) for slot in range(slots)]
+        return
+
+    def offset(self, slot, copy):
+        return self.HEADER.size + (slot * 2 + copy) * self.RECORD
+
+    def load(self, slot):
+        '''
+        Find the newest good copy for slot, returns (step, target, clean) or None.
+        '''
+        best = None
+        for copy in range(2):
+            offset = self.offset(slot, copy)
+            body = self.map[offset:offset + self.BODY.size]
+            crc, = self.CRC.unpack_from(self.map, offset + self.BODY.size)
+            sequence, step, target, flags = self.BODY.unpack(body)
+            if sequence == 0 or crc != zlib.crc32(body):
+                continue  # never written or torn
+            if best is None or sequence > best[0]:
+                best = (sequence, copy, step, target, flags)
+        if best is None:
+            return None
+        sequence, copy, step, target, flags = best
+        self.sequences[slot] = sequence
+        self.newest[slot] = copy
+        return (step, target, bool(flags & self.CLEAN))
+
+    def restore(self, slot):
+        '''
+        What was saved for slot when the journal was opened, or None.
+        '''
+        if slot >= self.slots:
+            return None
+        return self.saved[slot]
+
+    def record(self, slot, step, target, clean=False):
+        '''
+        Save the state of slot over the older of its two copies.
+        '''
+        if slot >= self.slots:
+            return
+        sequence = self.sequences[slot] + 1
+        copy = 1 - self.newest[slot]
+        flags = 0
+        if clean:
+            flags |= self.CLEAN
+        body = self.BODY.pack(sequence, step, target, flags)
+        offset = self.offset(slot, copy)
+        self.map[offset:offset + self.RECORD] = body + self.CRC.pack(zlib.crc32(body))
+        self.sequences[slot] = sequence
+        self.newest[slot] = copy
+        return
+
+    def flush(self):
+        self.map.flush()
+        return
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        return
+
+
+if __name__ == "__main__":
+    # for testing
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "turrets.journal")
+    journal = TurretJournal(path)
+    print("fresh:", journal.restore(0))
+    journal.record(0, 5, 8)
+    journal.record(0, 6, 8)
+    journal.record(1, 3, 3, clean=True)
+    journal.close()
+    journal = TurretJournal(path)
+    print("slot 0 (moving):", journal.restore(0))
+    print("slot 1 (clean):", journal.restore(1))
+    # tear the newest copy of slot 0, should fall back to the older one
+    offset = journal.offset(0, journal.newest[0])
+    journal.map[offset + 4] ^= 0xFF
+    journal.close()
+    journal = TurretJournal(path)
+    print("slot 0 (torn):", journal.restore(0))
+    journal.close()
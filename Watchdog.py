@@ -0,0 +1,147 @@
+# !/usr/bin/python3
+"""
+Watchdog - call something if a connection goes quiet for too long.
+
+If the phone's link stalls while the navigation stick is held,
+nothing lifts it and the motors keep going at their last setting.
+Each connection being watched feeds the watchdog whenever an input
+arrives, and if it is not fed again within its timeout the watchdog
+calls its action (e.g. the boat's stop()).
+
+All the timers are kept on a single timer wheel run by one thread,
+so feeding is just recording a new deadline, and the thread only
+wakes each tick while there is something to watch.
+How late each timeout is noticed (the detection latency) is recorded.
+"""
+
+from threading import Thread, Condition
+from time import monotonic
+
+
+class Watchdog(Thread):
+    '''
+    Watchdog(tick, slots)
+    Where "tick" is the time between looking at the wheel in seconds
+    (default 0.01), and so roughly the worst detection latency,
+    and "slots" the number of ticks round the wheel (default 256).
+
+    watchdog.feed(key, timeout, action) calls action() if key is not fed
+    again within timeout seconds, watchdog.cancel(key) stops watching it.
+    watchdog.fired, lastLatency, maxLatency and meanLatency() record
+    how many timeouts there have been and how late they were noticed.
+    watchdog.stop() ends the thread.
+    '''
+
+    def __init__(self, tick=0.01, slots=256):
+        Thread.__init__(self, daemon=True)
+        self.tick = tick
+        self.wheel = [[] for i in range(slots)]
+        self.timers = {}  # key: [deadline, action, on the wheel]
+        self.cursor = int(monotonic() / tick)  # next tick to look at
+        self.changed = Condition()
+        self.fired = 0
+        self.lastLatency = 0.0
+        self.maxLatency = 0.0
+        self.totalLatency = 0.0
+        self.ok = True
+        return
+
+    def feed(self, key, timeout, action):
+        deadline = monotonic() + timeout
+        with self.changed:
+            timer = self.timers.get(key)
+            if timer:
+                # just move the deadline, it is checked when its slot comes up
+                timer[0] = deadline
+                timer[1] = action
+                if timer[2]:
+                    return
+            else:
+                timer = [deadline, action, False]
+                if not self.timers:
+                    self.changed.notify()  # wake the wheel
+                self.timers[key] = timer
+            self.place(key, timer)
+        return
+
+    def cancel(self, key):
+        with self.changed:
+            self.timers.pop(key, None)  # left on the wheel to be ignored
+        return
+
+    def place(self, key, timer):
+        # put on the wheel at the slot for its deadline (or the next one)
+        slot = max(int(timer[0] / self.tick), self.cursor)
+        self.wheel[slot % len(self.wheel)].append(key)
+        timer[2] = True
+        return
+
+    def meanLatency(self):
+        if self.fired:
+            return self.totalLatency / self.fired
+        return 0.0
+
+    def stop(self):
+        with self.changed:
+            self.ok = False
+            self.changed.notify()
+        return
+
+    def run(self):
+        tick = self.tick
+        while self.ok:
+            due = []
+            with self.changed:
+                if not self.timers:
+                    self.changed.wait()  # nothing to watch, so sleep till there is
+                    self.cursor = int(monotonic() / tick)
+                    continue
+                now = monotonic()
+                current = int(now / tick)
+                while self.cursor <= current:
+                    slot = self.wheel[self.cursor % len(self.wheel)]
+                    self.cursor += 1
+                    keys = slot[:]
+                    slot.clear()
+                    for key in keys:
+                        timer = self.timers.get(key)
+                        if not timer or not timer[2]:
+                            continue  # cancelled (or already placed again)
+                        timer[2] = False
+                        if timer[0] > now:  # fed since, or round the wheel again
+                            self.place(key, timer)
+                        else:
+                            del self.timers[key]
+                            due.append(timer)
+                if self.timers:
+                    self.changed.wait(self.cursor * tick - monotonic())
+            for deadline, action, placed in due:
+                latency = now - deadline
+                self.fired += 1
+                self.lastLatency = latency
+                self.totalLatency += latency
+                if latency > self.maxLatency:
+                    self.maxLatency = latency
+                action()
+        return
+
+
+if __name__ == '__main__':
+    from time import sleep
+
+    watchdog = Watchdog()
+    watchdog.start()
+    timeouts = []
+    for i in range(20):
+        watchdog.feed("navigate", 0.05, lambda: timeouts.append(monotonic()))
+        sleep(0.01)  # fed in time, so nothing should happen
+    print("fed: timeouts =", len(timeouts))
+    for i in range(10):
+        watchdog.feed("navigate", 0.05, lambda: timeouts.append(monotonic()))
+        sleep(0.1)  # starved each time
+    print("starved: timeouts =", len(timeouts), "fired =", watchdog.fired)
+    print("latency: last %.1f ms, max %.1f ms, mean %.1f ms" % (
+        1000 * watchdog.lastLatency, 1000 * watchdog.maxLatency,
+        1000 * watchdog.meanLatency()))
+    watchdog.stop()
+    watchdog.join()